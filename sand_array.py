@@ -0,0 +1,133 @@
+import numpy as np
+
+from sand_engine import (BOARD_ROWS, BOARD_COLUMNS, PLAYER_COLUMNS, CARD_HP, CARD_COST, ENEMY_DAMAGE,
+                         BUNKER_DAMAGE, PLAYER_DAMAGE, START_RESOURCES, PRODUCTION_RATE, TICK_PERIOD,
+                         ECONOMY_PERIOD, TICK_RATE, Scheduler)
+
+OWNER_PLAYER = 0
+OWNER_ENEMY = 1
+EMPTY = -1
+
+
+class ArrayWorld:
+    def __init__(self, rows=BOARD_ROWS, columns=BOARD_COLUMNS, seed=None, spawns_per_tick=1, tick_rate=TICK_RATE):
+        self.rows = rows
+        self.columns = columns
+        self.spawns_per_tick = spawns_per_tick
+        self.paused = False
+        self.speed = 1.0
+        self.scheduler = Scheduler(tick_rate)
+        self.scheduler.register("spawn", TICK_PERIOD, self.spawn_enemies)
+        self.scheduler.register("move", TICK_PERIOD, self.move_enemies)
+        self.scheduler.register("economy", ECONOMY_PERIOD, self.update_resources)
+        self.reset(seed)
+
+    def reset(self, seed=None):
+        self.rng = np.random.default_rng(seed)
+        self.scheduler.reset()
+        self.hp = np.empty(0, np.int32)
+        self.owner = np.empty(0, np.int8)
+        self.lane = np.empty(0, np.int32)
+        self.col = np.empty(0, np.int32)
+        self.protected = np.zeros((self.rows, self.columns), bool)
+        self.grid = np.full((self.rows, self.columns), EMPTY, np.int32)
+        self.resources = dict(START_RESOURCES)
+        self.production_rate = dict(PRODUCTION_RATE)
+        self.lost = False
+
+    def __len__(self):
+        return len(self.hp)
+
+    def count(self, owner):
+        return int(np.count_nonzero(self.owner == owner))
+
+    def rebuild_grid(self):
+        self.grid.fill(EMPTY)
+        self.grid[self.lane, self.col] = np.arange(len(self.hp), dtype=np.int32)
+
+    def add_units(self, owner, lanes, cols, hp=CARD_HP):
+        lanes = np.asarray(lanes, np.int32)
+        cols = np.asarray(cols, np.int32)
+        free = self.grid[lanes, cols] == EMPTY
+        lanes, cols = lanes[free], cols[free]
+        first = np.unique(lanes * self.columns + cols, return_index=True)[1]
+        lanes, cols = lanes[first], cols[first]
+        self.hp = np.concatenate([self.hp, np.full(len(lanes), hp, np.int32)])
+        self.owner = np.concatenate([self.owner, np.full(len(lanes), owner, np.int8)])
+        self.lane = np.concatenate([self.lane, lanes])
+        self.col = np.concatenate([self.col, cols])
+        self.rebuild_grid()
+        return len(lanes)
+
+    def place_cards(self, lanes, cols):
+        lanes = np.asarray(lanes, np.int32)
+        cols = np.asarray(cols, np.int32)
+        keep = cols < PLAYER_COLUMNS
+        affordable = min(self.resources[name] // cost for name, cost in CARD_COST.items())
+        placed = self.add_units(OWNER_PLAYER, lanes[keep][:affordable], cols[keep][:affordable])
+        for name, cost in CARD_COST.items():
+            self.resources[name] -= cost * placed
+        return placed
+
+    def protect(self, lanes, cols):
+        self.protected[np.asarray(lanes, np.int32), np.asarray(cols, np.int32)] = True
+
+    def step(self, dt):
+        if self.paused:
+            return 0
+        return self.scheduler.advance(dt * self.speed)
+
+    def update_resources(self):
+        self.resources["ammunition"] += self.production_rate["ammunition"] * self.resources["supply"]
+        self.resources["prodpoint"] += self.production_rate["prodpoint"] * self.resources["supply"]
+
+    def spawn_enemies(self):
+        enemy_lanes = np.zeros(self.rows, bool)
+        enemy_lanes[self.lane[self.owner == OWNER_ENEMY]] = True
+        free_lanes = np.flatnonzero(~enemy_lanes & (self.grid[:, -1] == EMPTY))
+        if len(free_lanes) == 0:
+            return 0
+        count = min(self.spawns_per_tick, len(free_lanes))
+        lanes = self.rng.choice(free_lanes, size=count, replace=False)
+        return self.add_units(OWNER_ENEMY, lanes, np.full(count, self.columns - 1, np.int32))
+
+    def move_enemies(self):
+        enemies = np.flatnonzero(self.owner == OWNER_ENEMY)
+        if len(enemies) == 0:
+            return
+        lanes = self.lane[enemies]
+        target_cols = self.col[enemies] - 1
+        at_edge = target_cols < 0
+        if at_edge.any():
+            self.lost = True
+        enemies, lanes, target_cols = enemies[~at_edge], lanes[~at_edge], target_cols[~at_edge]
+        occupant = self.grid[lanes, target_cols]
+        free = occupant == EMPTY
+        fighting = ~free
+        fighting[fighting] = self.owner[occupant[fighting]] == OWNER_PLAYER
+        attackers = enemies[fighting]
+        defenders = occupant[fighting]
+        damage = np.where(self.protected[lanes[fighting], target_cols[fighting]], BUNKER_DAMAGE, ENEMY_DAMAGE)
+        self.hp[defenders] -= damage.astype(np.int32)
+        self.hp[attackers] -= PLAYER_DAMAGE
+        movers = enemies[free]
+        self.col[movers] = target_cols[free]
+        self.remove_dead()
+
+    def remove_dead(self):
+        alive = self.hp > 0
+        if alive.all():
+            self.rebuild_grid()
+            return
+        self.hp = self.hp[alive]
+        self.owner = self.owner[alive]
+        self.lane = self.lane[alive]
+        self.col = self.col[alive]
+        self.rebuild_grid()
+
+    def visible(self, first_row, first_col, rows, columns):
+        mask = ((self.lane >= first_row) & (self.lane < first_row + rows) &
+                (self.col >= first_col) & (self.col < first_col + columns))
+        indices = np.flatnonzero(mask)
+        return zip(self.owner[indices].tolist(), self.lane[indices].tolist(), self.col[indices].tolist(),
+                   self.hp[indices].tolist())
@@ -0,0 +1,109 @@
+import os
+import sys
+import json
+import hashlib
+import argparse
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+
+import pygame
+from sand_game import (ASSET_SIZES, BAKE_DIR, BAKE_MANIFEST, BAKE_VERSION, bake_key, bake_name, file_hash,
+                       write_atomic)
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg")
+
+
+def bake(root, output):
+    os.makedirs(output, exist_ok=True)
+    entries = {}
+    baked_bytes = 0
+    for source, sizes in ASSET_SIZES.items():
+        fullname = os.path.join(root, source)
+        stat = os.stat(fullname)
+        digest = file_hash(fullname)
+        image = pygame.image.load(fullname)
+        for size in sizes:
+            scaled = pygame.transform.scale(image, size) if size else image
+            data = pygame.image.tobytes(scaled, "RGBA")
+            blob = bake_name(source, size)
+            write_atomic(os.path.join(output, blob), data)
+            entries[bake_key(source, size)] = {
+                "blob": blob,
+                "size": list(scaled.get_size()),
+                "hash": hashlib.sha256(data).hexdigest(),
+                "source_hash": digest,
+                "source_size": stat.st_size,
+                "source_mtime": stat.st_mtime_ns,
+            }
+            baked_bytes += len(data)
+        print(f"{source:36} {os.path.getsize(fullname) // 1024:6} KiB -> {', '.join(blob_sizes(sizes, image))}")
+    blobs = {entry["blob"] for entry in entries.values()}
+    for name in os.listdir(output):
+        if name.endswith(".rgba") and name not in blobs:
+            os.remove(os.path.join(output, name))
+    manifest = {"version": BAKE_VERSION, "entries": entries}
+    write_atomic(os.path.join(output, BAKE_MANIFEST), json.dumps(manifest, indent=2).encode())
+    print(f"baked {len(entries)} surfaces, {baked_bytes // 1024} KiB")
+    return entries
+
+
+def blob_sizes(sizes, image):
+    return [f"{size[0]}x{size[1]}" if size else "x".join(map(str, image.get_size())) for size in sizes]
+
+
+def unused_images(root):
+    directory = os.path.join(root, "data")
+    return sorted(f"data/{name}" for name in os.listdir(directory)
+                  if name.lower().endswith(IMAGE_EXTENSIONS) and f"data/{name}" not in ASSET_SIZES)
+
+
+def check(root, output):
+    try:
+        with open(os.path.join(output, BAKE_MANIFEST), "r") as file:
+            manifest = json.load(file)
+    except (OSError, ValueError):
+        print("no manifest")
+        return ["manifest"]
+    problems = []
+    entries = manifest.get("entries", {}) if manifest.get("version") == BAKE_VERSION else {}
+    for source, sizes in ASSET_SIZES.items():
+        digest = file_hash(os.path.join(root, source))
+        for size in sizes:
+            key = bake_key(source, size)
+            entry = entries.get(key)
+            if entry is None:
+                problems.append(f"{key} missing")
+            elif entry["source_hash"] != digest:
+                problems.append(f"{key} stale")
+            else:
+                try:
+                    with open(os.path.join(output, entry["blob"]), "rb") as file:
+                        if hashlib.sha256(file.read()).hexdigest() != entry["hash"]:
+                            problems.append(f"{key} corrupt")
+                except OSError:
+                    problems.append(f"{key} blob missing")
+    for problem in problems:
+        print(problem)
+    return problems
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Pre-scale Sand Line images into raw surface blobs")
+    parser.add_argument("--root", default=".", help="directory containing data/")
+    parser.add_argument("--output", help=f"bake directory, defaults to <root>/{BAKE_DIR}")
+    parser.add_argument("--check", action="store_true", help="verify the bake instead of rebuilding it")
+    args = parser.parse_args(argv)
+    output = args.output or os.path.join(args.root, BAKE_DIR)
+
+    pygame.init()
+    if args.check:
+        return 1 if check(args.root, output) else 0
+    bake(args.root, output)
+    unused = unused_images(args.root)
+    if unused:
+        print(f"not used by the game: {', '.join(unused)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
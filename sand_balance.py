@@ -0,0 +1,239 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import multiprocessing
+
+import sand_engine
+from sand_engine import Engine, BOARD_ROWS, BOARD_COLUMNS, PLAYER_COLUMNS, ENEMY
+
+DEFAULT_GAMES = 1000
+DEFAULT_MAX_SECONDS = 600
+DEFAULT_CHUNK = 25
+RESOURCE_NAMES = ("supply", "ammunition", "prodpoint")
+
+
+def defend(engine):
+    for row in range(engine.rows):
+        if not engine.index.row_enemies[row]:
+            continue
+        if any(engine.unit_at(row, col) for col in range(PLAYER_COLUMNS)):
+            continue
+        for col in range(PLAYER_COLUMNS - 1, -1, -1):
+            if not engine.unit_at(row, col):
+                engine.place_card(row, col)
+                break
+
+
+def affordable(engine, kind, reserve):
+    left = engine.resources["prodpoint"] - sand_engine.UPGRADE_COSTS[kind]
+    return left >= reserve * sand_engine.CARD_COST["prodpoint"]
+
+
+def buy_trucks(engine, options):
+    if not affordable(engine, "supply", options["reserve"]):
+        return
+    for row in range(min(options["trucks"], engine.rows)):
+        if not engine.upgrade_at(row, 0):
+            engine.place_upgrade("supply", row, 0)
+            return
+
+
+def play_cards(engine, options):
+    defend(engine)
+
+
+def play_trucks(engine, options):
+    defend(engine)
+    buy_trucks(engine, options)
+
+
+def play_bunkers(engine, options):
+    defend(engine)
+    buy_trucks(engine, options)
+    if not affordable(engine, "bunker", options["reserve"]):
+        return
+    for unit in engine.players:
+        if not engine.upgrade_at(unit.row, unit.col):
+            engine.place_upgrade("bunker", unit.row, unit.col)
+            break
+
+
+STRATEGIES = {
+    "cards": play_cards,
+    "trucks": play_trucks,
+    "bunkers": play_bunkers,
+}
+
+
+def configure(card_cost, upgrade_costs):
+    sand_engine.CARD_COST.update(card_cost)
+    sand_engine.UPGRADE_COSTS.update(upgrade_costs)
+
+
+def new_totals(rows, seconds):
+    return {
+        "games": 0,
+        "lost": 0,
+        "ticks": 0,
+        "survival": [],
+        "breach_lanes": [0] * rows,
+        "cards_lost": [0] * rows,
+        "enemies_killed": 0,
+        "curve_sum": [[0] * len(RESOURCE_NAMES) for _ in range(seconds + 1)],
+        "curve_count": [0] * (seconds + 1),
+    }
+
+
+def sample(engine, second, totals):
+    sums = totals["curve_sum"][second]
+    for i, name in enumerate(RESOURCE_NAMES):
+        sums[i] += engine.resources[name]
+    totals["curve_count"][second] += 1
+
+
+def play_game(strategy, seed, rows, max_seconds, options, totals):
+    engine = Engine(rows, BOARD_COLUMNS, seed)
+
+    def listener(event, unit):
+        if event == "kill":
+            if unit.owner == ENEMY:
+                totals["enemies_killed"] += 1
+            else:
+                totals["cards_lost"][unit.row] += 1
+
+    engine.listener = listener
+    play = STRATEGIES[strategy]
+    tick_dt = engine.scheduler.tick_dt
+    ticks_per_second = engine.scheduler.tick_rate
+    max_ticks = max_seconds * ticks_per_second
+    sample(engine, 0, totals)
+    while not engine.lost and engine.scheduler.tick < max_ticks:
+        play(engine, options)
+        engine.step(tick_dt)
+        if engine.scheduler.tick % ticks_per_second == 0:
+            sample(engine, engine.scheduler.tick // ticks_per_second, totals)
+    totals["games"] += 1
+    totals["ticks"] += engine.scheduler.tick
+    totals["survival"].append(engine.scheduler.tick / ticks_per_second)
+    if engine.lost:
+        totals["lost"] += 1
+        breach = next((enemy for enemy in engine.enemies if enemy.col == 0), None)
+        if breach:
+            totals["breach_lanes"][breach.row] += 1
+
+
+def run_chunk(task):
+    strategy, seeds, rows, max_seconds, options = task
+    totals = new_totals(rows, max_seconds)
+    for seed in seeds:
+        play_game(strategy, seed, rows, max_seconds, options, totals)
+    return totals
+
+
+def merge(totals, part):
+    for key in ("games", "lost", "ticks", "enemies_killed"):
+        totals[key] += part[key]
+    totals["survival"].extend(part["survival"])
+    for key in ("breach_lanes", "cards_lost", "curve_count"):
+        totals[key] = [a + b for a, b in zip(totals[key], part[key])]
+    totals["curve_sum"] = [[a + b for a, b in zip(row, part_row)]
+                           for row, part_row in zip(totals["curve_sum"], part["curve_sum"])]
+
+
+def summarize(strategy, totals, elapsed):
+    survival = sorted(totals["survival"])
+    deciles = statistics.quantiles(survival, n=10) if len(survival) > 1 else survival * 9
+    curve = {name: [] for name in RESOURCE_NAMES}
+    for sums, count in zip(totals["curve_sum"], totals["curve_count"]):
+        if not count:
+            break
+        for i, name in enumerate(RESOURCE_NAMES):
+            curve[name].append(round(sums[i] / count, 2))
+    return {
+        "strategy": strategy,
+        "games": totals["games"],
+        "loss_rate": totals["lost"] / totals["games"],
+        "survival_seconds": {
+            "mean": statistics.fmean(survival),
+            "median": statistics.median(survival),
+            "p10": deciles[0],
+            "p90": deciles[-1],
+        },
+        "breach_lanes": totals["breach_lanes"],
+        "cards_lost_per_lane": totals["cards_lost"],
+        "enemies_killed_per_game": totals["enemies_killed"] / totals["games"],
+        "resource_curve": curve,
+        "elapsed": elapsed,
+        "games_per_second": totals["games"] / elapsed,
+        "ticks_per_second": totals["ticks"] / elapsed,
+    }
+
+
+def simulate(strategy, games, rows, max_seconds, options, workers, seed=0, chunk=DEFAULT_CHUNK,
+             card_cost=None, upgrade_costs=None):
+    seeds = list(range(seed, seed + games))
+    tasks = [(strategy, seeds[i:i + chunk], rows, max_seconds, options) for i in range(0, games, chunk)]
+    config = (card_cost or {}, upgrade_costs or {})
+    totals = new_totals(rows, max_seconds)
+    start = time.perf_counter()
+    if workers == 1:
+        configure(*config)
+        for task in tasks:
+            merge(totals, run_chunk(task))
+    else:
+        with multiprocessing.Pool(workers, initializer=configure, initargs=config) as pool:
+            for part in pool.imap_unordered(run_chunk, tasks):
+                merge(totals, part)
+    return summarize(strategy, totals, time.perf_counter() - start)
+
+
+def parse_costs(text):
+    costs = {}
+    for item in filter(None, (text or "").split(",")):
+        name, value = item.split("=")
+        costs[name.strip()] = int(value)
+    return costs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sand Line Monte Carlo balance simulator")
+    parser.add_argument("--strategy", nargs="*", choices=sorted(STRATEGIES), default=sorted(STRATEGIES))
+    parser.add_argument("--games", type=int, default=DEFAULT_GAMES, help="games per strategy")
+    parser.add_argument("--max-seconds", type=int, default=DEFAULT_MAX_SECONDS, help="game length cap")
+    parser.add_argument("--rows", type=int, default=BOARD_ROWS, help="lanes on the board")
+    parser.add_argument("--trucks", type=int, default=2, help="trucks bought by the truck and bunker strategies")
+    parser.add_argument("--reserve", type=int, default=0,
+                        help="cards' worth of prodpoint kept back when buying upgrades")
+    parser.add_argument("--card-cost", help="override card costs, e.g. ammunition=25,prodpoint=15")
+    parser.add_argument("--upgrade-cost", help="override upgrade costs, e.g. supply=150,bunker=300")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--seed", type=int, default=0, help="seed of the first game")
+    parser.add_argument("--output", default="balance_results.json", help="results file")
+    args = parser.parse_args(argv)
+
+    options = {"trucks": args.trucks, "reserve": args.reserve}
+    results = {
+        "config": {"games": args.games, "max_seconds": args.max_seconds, "rows": args.rows,
+                   "options": options, "seed": args.seed, "workers": args.workers,
+                   "card_cost": dict(sand_engine.CARD_COST, **parse_costs(args.card_cost)),
+                   "upgrade_costs": dict(sand_engine.UPGRADE_COSTS, **parse_costs(args.upgrade_cost))},
+        "strategies": [],
+    }
+    for strategy in args.strategy:
+        summary = simulate(strategy, args.games, args.rows, args.max_seconds, options, args.workers, args.seed,
+                           card_cost=parse_costs(args.card_cost), upgrade_costs=parse_costs(args.upgrade_cost))
+        results["strategies"].append(summary)
+        survival = summary["survival_seconds"]
+        print(f"{strategy:10} loss {summary['loss_rate'] * 100:5.1f}%  survival median {survival['median']:7.1f} s  "
+              f"p10 {survival['p10']:7.1f} s  breaches {summary['breach_lanes']}  "
+              f"{summary['games_per_second']:8.1f} games/s")
+    with open(args.output, "w") as file:
+        json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import sand_game
+from sand_engine import Engine, Unit, BOARD_COLUMNS, PLAYER, ENEMY
+try:
+    from sand_array import ArrayWorld, OWNER_PLAYER, OWNER_ENEMY
+except ImportError:
+    ArrayWorld = None
+
+DEFAULT_SIZE = 200
+DEFAULT_REPEAT = 30
+DEFAULT_THRESHOLD = 0.15
+DRAG_EVENTS = 500
+
+
+def move_enemies_scenario(size, bunkers):
+    engine = Engine(size, BOARD_COLUMNS, seed=1)
+
+    def setup():
+        engine.reset(1)
+        for row in range(size):
+            engine.add_unit(Unit(PLAYER, row, 3))
+            engine.add_unit(Unit(ENEMY, row, 4 if row % 2 == 0 else BOARD_COLUMNS - 1))
+            if bunkers:
+                engine.index.set_flag("protected", row, 3)
+        return engine.move_enemies
+    return setup
+
+
+def array_move_enemies_scenario(size, bunkers):
+    world = ArrayWorld(size, BOARD_COLUMNS, seed=1)
+    lanes = list(range(size))
+
+    def setup():
+        world.reset(1)
+        world.add_units(OWNER_PLAYER, lanes, [3] * size)
+        world.add_units(OWNER_ENEMY, lanes, [4 if row % 2 == 0 else BOARD_COLUMNS - 1 for row in lanes])
+        if bunkers:
+            world.protect(lanes, [3] * size)
+        return world.move_enemies
+    return setup
+
+
+def array_draw_scenario(size):
+    world = ArrayWorld(size, BOARD_COLUMNS, seed=1)
+    renderer = sand_game.ArrayWorldRenderer(world)
+    screen = pygame.Surface((sand_game.SCREEN_WIDTH, sand_game.SCREEN_HEIGHT))
+    lanes = [row for row in range(size) for col in range(4)]
+
+    def setup():
+        world.reset(1)
+        world.add_units(OWNER_PLAYER, lanes, [col for row in range(size) for col in range(4)])
+        world.add_units(OWNER_ENEMY, range(size), [BOARD_COLUMNS - 1] * size)
+        return lambda: renderer.draw(screen, size // 2)
+    return setup
+
+
+def spawn_enemy_scenario(size):
+    engine = Engine(size, BOARD_COLUMNS, seed=1)
+
+    def setup():
+        engine.reset(1)
+        for row in range(size - 1):
+            engine.add_unit(Unit(ENEMY, row, BOARD_COLUMNS - 1))
+        return engine.spawn_enemy
+    return setup
+
+
+def new_game():
+    game = sand_game.Game(seed=1, autosave=False)
+    game.resources["ammunition"] = game.resources["prodpoint"] = 10 ** 6
+    return game
+
+
+def card_drop_scenario(size):
+    game = new_game()
+    tile = sand_game.TILE_SIZE
+
+    def setup():
+        game.restart()
+        for col in range(3):
+            game.engine.place_card(2, col)
+        card = game.unit_sprites[game.engine.place_card(4, 3)]
+        game.dragging_card = card
+        card.rect.center = (2 * tile + tile // 2, 2 * tile + tile // 2)
+        return game.handle_card_drop
+    return setup
+
+
+def draw_scenario(size):
+    game = new_game()
+
+    def setup():
+        game.restart()
+        for row in range(game.engine.rows):
+            for col in range(4):
+                game.engine.place_card(row, col)
+        game.engine.step(5.0)
+        game.full_redraw = True
+        return game.draw
+    return setup
+
+
+def drag_events_scenario(size):
+    game = new_game()
+    tile = sand_game.TILE_SIZE
+
+    def setup():
+        game.restart()
+        game.engine.place_card(1, 1)
+        pygame.event.clear()
+        pygame.event.post(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=(tile + 10, tile + 10), button=1))
+        for i in range(DRAG_EVENTS):
+            pos = (tile + 10 + i % 300, tile + 10 + i % 200)
+            pygame.event.post(pygame.event.Event(pygame.MOUSEMOTION, pos=pos, rel=(1, 1), buttons=(1, 0, 0)))
+        return game.handle_events
+    return setup
+
+
+SCENARIOS = {
+    "move_enemies": lambda size: move_enemies_scenario(size, False),
+    "move_enemies_bunkers": lambda size: move_enemies_scenario(size, True),
+    "spawn_enemy_full_board": spawn_enemy_scenario,
+    "handle_card_drop_fallback": card_drop_scenario,
+    "draw_frame": draw_scenario,
+    "handle_events_drag_burst": drag_events_scenario,
+}
+if ArrayWorld is not None:
+    SCENARIOS.update({
+        "array_move_enemies": lambda size: array_move_enemies_scenario(size, False),
+        "array_move_enemies_bunkers": lambda size: array_move_enemies_scenario(size, True),
+        "array_draw_visible": array_draw_scenario,
+    })
+
+
+def measure(setup, repeat):
+    timings = []
+    for _ in range(repeat):
+        run = setup()
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    run = setup()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    run()
+    after = tracemalloc.take_snapshot()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return {
+        "runs": repeat,
+        "min": min(timings),
+        "median": statistics.median(timings),
+        "mean": statistics.fmean(timings),
+        "alloc_blocks": blocks,
+        "peak_bytes": peak,
+    }
+
+
+def run_benchmarks(names, size, repeat):
+    results = {}
+    for name in names:
+        results[name] = measure(SCENARIOS[name](size), repeat)
+        print(f"{name:28} median {results[name]['median'] * 1000:9.3f} ms  "
+              f"min {results[name]['min'] * 1000:9.3f} ms  "
+              f"blocks {results[name]['alloc_blocks']:6}  peak {results[name]['peak_bytes'] / 1024:8.1f} KiB")
+    return {
+        "meta": {"python": platform.python_version(), "pygame": pygame.version.ver, "size": size, "repeat": repeat},
+        "scenarios": results,
+    }
+
+
+def compare(baseline, current, threshold):
+    regressions = []
+    for name, result in current["scenarios"].items():
+        base = baseline["scenarios"].get(name)
+        if base is None:
+            print(f"{name:28} no baseline")
+            continue
+        ratio = result["median"] / base["median"] if base["median"] else 1.0
+        flag = "REGRESSION" if ratio > 1 + threshold else ""
+        print(f"{name:28} {base['median'] * 1000:9.3f} -> {result['median'] * 1000:9.3f} ms  x{ratio:5.2f}  {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sand Line headless benchmarks")
+    parser.add_argument("--size", type=int, default=DEFAULT_SIZE, help="lanes for engine scenarios")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="timed runs per scenario")
+    parser.add_argument("--only", nargs="*", choices=sorted(SCENARIOS), help="scenarios to run")
+    parser.add_argument("--save", help="write results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="allowed slowdown of the median before flagging a regression")
+    args = parser.parse_args(argv)
+
+    pygame.init()
+    results = run_benchmarks(args.only or list(SCENARIOS), args.size, args.repeat)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare, "r") as file:
+            baseline = json.load(file)
+        if compare(baseline, results, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
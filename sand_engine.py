@@ -0,0 +1,509 @@
+import zlib
+import struct
+import random
+
+BOARD_ROWS = 6
+BOARD_COLUMNS = 10
+PLAYER_COLUMNS = 4
+TICK_RATE = 20
+MAX_CATCHUP_TICKS = 25
+TICK_PERIOD = 1.0
+ECONOMY_PERIOD = 1.0
+CARD_HP = 100
+CARD_COST = {"ammunition": 25, "prodpoint": 15}
+UPGRADE_COSTS = {"supply": 150, "bunker": 300}
+ENEMY_DAMAGE = 25
+BUNKER_DAMAGE = 12
+PLAYER_DAMAGE = 40
+START_RESOURCES = {"supply": 1, "ammunition": 200, "prodpoint": 150}
+PRODUCTION_RATE = {"ammunition": 4, "prodpoint": 5}
+DROP_FALLBACKS = [(0, -1), (0, -2), (-1, 0), (1, 0)]
+PLAYER = "player"
+ENEMY = "enemy"
+SNAPSHOT_MAGIC = b"SAND"
+SNAPSHOT_VERSION = 2
+SNAPSHOT_HEADER = struct.Struct("<4sHHHQIdd??i")
+SNAPSHOT_RESOURCES = ("supply", "ammunition", "prodpoint")
+SNAPSHOT_PRODUCTION = ("ammunition", "prodpoint")
+SNAPSHOT_RNG = struct.Struct("<625I?d")
+OWNER_CODES = (PLAYER, ENEMY)
+UPGRADE_KINDS = ("supply", "bunker")
+
+
+def tile_type_for(col):
+    if col < 1:
+        return "trencher"
+    elif col < PLAYER_COLUMNS:
+        return "trench"
+    return "dirt"
+
+
+def upgrade_allowed(kind, col):
+    if kind == "bunker":
+        return col < PLAYER_COLUMNS
+    if kind == "supply":
+        return col == 0
+    return False
+
+
+def pack_columns(codes, records):
+    parts = [struct.pack("<I", len(records))]
+    for code, column in zip(codes, zip(*records) if records else [()] * len(codes)):
+        parts.append(struct.pack(f"<{len(records)}{code}", *column))
+    return b"".join(parts)
+
+
+def unpack_columns(codes, data, offset):
+    count = struct.unpack_from("<I", data, offset)[0]
+    offset += 4
+    columns = []
+    for code in codes:
+        layout = f"<{count}{code}"
+        columns.append(struct.unpack_from(layout, data, offset))
+        offset += struct.calcsize(layout)
+    return list(zip(*columns)), offset
+
+
+class Tile:
+    def __init__(self, tile_type, row, col):
+        self.tile_type = tile_type
+        self.row = row
+        self.col = col
+        self.upgrade_type = None
+        self.protected = False
+
+    def apply_upgrade(self, upgrade_type, resources):
+        if upgrade_type == "supply":
+            resources["supply"] += 1
+            self.upgrade_type = upgrade_type
+        elif upgrade_type == "bunker":
+            self.protected = True
+            self.upgrade_type = upgrade_type
+
+
+class Board:
+    def __init__(self, rows=BOARD_ROWS, columns=BOARD_COLUMNS):
+        self.rows = rows
+        self.columns = columns
+        self.tiles = [[Tile(tile_type_for(col), row, col) for col in range(columns)] for row in range(rows)]
+
+    def in_bounds(self, row, col):
+        return 0 <= row < self.rows and 0 <= col < self.columns
+
+    def tile(self, row, col):
+        if self.in_bounds(row, col):
+            return self.tiles[row][col]
+        return None
+
+
+class OccupancyIndex:
+    def __init__(self, rows):
+        self.units = {}
+        self.upgrades = {}
+        self.flags = {"protected": set()}
+        self.row_enemies = [0] * rows
+
+    def add_unit(self, unit):
+        self.units[(unit.row, unit.col)] = unit
+        if unit.owner == ENEMY:
+            self.row_enemies[unit.row] += 1
+
+    def remove_unit(self, unit):
+        if self.units.get((unit.row, unit.col)) is unit:
+            del self.units[(unit.row, unit.col)]
+        if unit.owner == ENEMY:
+            self.row_enemies[unit.row] -= 1
+
+    def move_unit(self, unit, row, col):
+        self.remove_unit(unit)
+        unit.row, unit.col = row, col
+        self.add_unit(unit)
+
+    def unit_at(self, row, col, exclude=None):
+        unit = self.units.get((row, col))
+        if unit is exclude:
+            return None
+        return unit
+
+    def add_upgrade(self, upgrade):
+        self.upgrades[(upgrade.row, upgrade.col)] = upgrade
+
+    def upgrade_at(self, row, col):
+        return self.upgrades.get((row, col))
+
+    def set_flag(self, name, row, col):
+        self.flags[name].add((row, col))
+
+    def has_flag(self, name, row, col):
+        return (row, col) in self.flags[name]
+
+
+class Scheduler:
+    def __init__(self, tick_rate=TICK_RATE, max_catchup=MAX_CATCHUP_TICKS):
+        self.tick_rate = tick_rate
+        self.tick_dt = 1.0 / tick_rate
+        self.max_catchup = max_catchup
+        self.systems = []
+        self.reset()
+
+    def reset(self):
+        self.tick = 0
+        self.accumulator = 0.0
+
+    def register(self, name, period, callback):
+        self.systems.append((name, max(1, round(period * self.tick_rate)), callback))
+
+    def period(self, name):
+        return next(period for system, period, callback in self.systems if system == name)
+
+    def alpha(self):
+        return self.accumulator / self.tick_dt
+
+    def advance(self, dt):
+        self.accumulator += dt
+        ticks = 0
+        while self.accumulator >= self.tick_dt:
+            if ticks >= self.max_catchup:
+                self.accumulator = 0.0
+                break
+            self.accumulator -= self.tick_dt
+            self.run_tick()
+            ticks += 1
+        return ticks
+
+    def run_tick(self):
+        self.tick += 1
+        for name, period, callback in self.systems:
+            if self.tick % period == 0:
+                callback()
+
+
+class Unit:
+    __slots__ = ("owner", "row", "col", "hp", "alive", "prev_row", "prev_col", "moved_tick")
+
+    def __init__(self, owner, row, col, hp=CARD_HP):
+        self.owner = owner
+        self.row = row
+        self.col = col
+        self.hp = hp
+        self.alive = True
+        self.prev_row = row
+        self.prev_col = col
+        self.moved_tick = None
+
+
+class Upgrade:
+    __slots__ = ("kind", "row", "col", "cost")
+
+    def __init__(self, kind, row, col):
+        self.kind = kind
+        self.row = row
+        self.col = col
+        self.cost = UPGRADE_COSTS[kind]
+
+
+class PlaceCard:
+    def __init__(self, row, col):
+        self.row = row
+        self.col = col
+
+    def apply(self, engine):
+        return engine.place_card(self.row, self.col)
+
+
+class MoveCard:
+    def __init__(self, from_row, from_col, row, col):
+        self.from_row = from_row
+        self.from_col = from_col
+        self.row = row
+        self.col = col
+
+    def apply(self, engine):
+        return engine.move_card(self.from_row, self.from_col, self.row, self.col)
+
+
+class PlaceUpgrade:
+    def __init__(self, kind, row, col):
+        self.kind = kind
+        self.row = row
+        self.col = col
+
+    def apply(self, engine):
+        return engine.place_upgrade(self.kind, self.row, self.col)
+
+
+class DirectSpawn:
+    def __init__(self, row):
+        self.row = row
+
+    def apply(self, engine):
+        return engine.direct_spawn(self.row)
+
+
+class Engine:
+    def __init__(self, rows=BOARD_ROWS, columns=BOARD_COLUMNS, seed=None, tick_rate=TICK_RATE):
+        self.rows = rows
+        self.columns = columns
+        self.listener = None
+        self.paused = False
+        self.speed = 1.0
+        self.scheduler = Scheduler(tick_rate)
+        self.scheduler.register("spawn", TICK_PERIOD, self.spawn_enemy)
+        self.scheduler.register("move", TICK_PERIOD, self.move_enemies)
+        self.scheduler.register("economy", ECONOMY_PERIOD, self.update_resources)
+        self.move_ticks = self.scheduler.period("move")
+        self.rng = random.Random()
+        self.reset(random.randrange(2 ** 32) if seed is None else seed)
+
+    def reset(self, seed=None):
+        if seed is None:
+            seed = self.rng.randrange(2 ** 32)
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.scheduler.reset()
+        self.board = Board(self.rows, self.columns)
+        self.index = OccupancyIndex(self.rows)
+        self.players = {}
+        self.enemies = {}
+        self.upgrades = []
+        self.resources = dict(START_RESOURCES)
+        self.production_rate = dict(PRODUCTION_RATE)
+        self.lost = False
+        self.spawn_row = None
+        self.emit("reset", None)
+
+    def emit(self, event, item):
+        if self.listener:
+            self.listener(event, item)
+
+    def execute(self, command):
+        return command.apply(self)
+
+    def step(self, dt):
+        if self.paused:
+            return 0
+        return self.scheduler.advance(dt * self.speed)
+
+    def snapshot(self):
+        version, state, gauss = self.rng.getstate()
+        units = list(self.players) + list(self.enemies)
+        return b"".join([
+            SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.rows, self.columns, self.seed,
+                                 self.scheduler.tick, self.scheduler.accumulator, self.speed, self.paused, self.lost,
+                                 -1 if self.spawn_row is None else self.spawn_row),
+            struct.pack("<3q", *(self.resources[name] for name in SNAPSHOT_RESOURCES)),
+            struct.pack("<2q", *(self.production_rate[name] for name in SNAPSHOT_PRODUCTION)),
+            SNAPSHOT_RNG.pack(*state, gauss is not None, gauss or 0.0),
+            pack_columns("Biii", [(OWNER_CODES.index(unit.owner), unit.row, unit.col, unit.hp) for unit in units]),
+            pack_columns("Bii", [(UPGRADE_KINDS.index(upgrade.kind), upgrade.row, upgrade.col)
+                                 for upgrade in self.upgrades]),
+        ])
+
+    def restore(self, data):
+        magic, version, rows, columns, seed, tick, accumulator, speed, paused, lost, spawn_row = \
+            SNAPSHOT_HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version: {version}")
+        if (rows, columns) != (self.rows, self.columns):
+            raise ValueError(f"Snapshot board is {rows}x{columns}, expected {self.rows}x{self.columns}")
+        offset = SNAPSHOT_HEADER.size
+        resources = struct.unpack_from("<3q", data, offset)
+        production = struct.unpack_from("<2q", data, offset + 24)
+        offset += 40
+        rng_state = SNAPSHOT_RNG.unpack_from(data, offset)
+        offset += SNAPSHOT_RNG.size
+        units, offset = unpack_columns("Biii", data, offset)
+        upgrades, offset = unpack_columns("Bii", data, offset)
+        if not -1 <= spawn_row < rows:
+            raise ValueError(f"Snapshot spawn lane {spawn_row} is off the board")
+        cells = set()
+        for owner, row, col, hp in units:
+            if owner >= len(OWNER_CODES):
+                raise ValueError(f"Unknown unit owner code {owner}")
+            if not (0 <= row < rows and 0 <= col < columns) or (row, col) in cells:
+                raise ValueError(f"Invalid unit position {row},{col}")
+            cells.add((row, col))
+        for kind, row, col in upgrades:
+            if kind >= len(UPGRADE_KINDS):
+                raise ValueError(f"Unknown upgrade kind code {kind}")
+            if not (0 <= row < rows and 0 <= col < columns):
+                raise ValueError(f"Invalid upgrade position {row},{col}")
+        rng = random.Random()
+        rng.setstate((3, rng_state[:625], rng_state[626] if rng_state[625] else None))
+
+        self.seed = seed
+        self.rng = rng
+        self.spawn_row = None if spawn_row < 0 else spawn_row
+        self.scheduler.tick = tick
+        self.scheduler.accumulator = accumulator
+        self.speed = speed
+        self.paused = paused
+        self.lost = lost
+        self.board = Board(self.rows, self.columns)
+        self.index = OccupancyIndex(self.rows)
+        self.players = {}
+        self.enemies = {}
+        self.upgrades = []
+        self.resources = dict(zip(SNAPSHOT_RESOURCES, resources))
+        self.production_rate = dict(zip(SNAPSHOT_PRODUCTION, production))
+        for owner, row, col, hp in units:
+            self.add_unit(Unit(OWNER_CODES[owner], row, col, hp))
+        for kind, row, col in upgrades:
+            upgrade = Upgrade(UPGRADE_KINDS[kind], row, col)
+            tile = self.board.tile(row, col)
+            tile.upgrade_type = upgrade.kind
+            tile.protected = upgrade.kind == "bunker"
+            if tile.protected:
+                self.index.set_flag("protected", row, col)
+            self.upgrades.append(upgrade)
+            self.index.add_upgrade(upgrade)
+        self.emit("load", None)
+
+    def checksum(self):
+        state = (self.seed, self.scheduler.tick, sorted(self.resources.items()), self.lost,
+                 sorted((unit.owner, unit.row, unit.col, unit.hp) for unit in self.index.units.values()),
+                 sorted((upgrade.kind, upgrade.row, upgrade.col) for upgrade in self.upgrades))
+        return zlib.crc32(repr(state).encode())
+
+    def lane_checksums(self):
+        lanes = [[] for _ in range(self.rows)]
+        for unit in self.index.units.values():
+            lanes[unit.row].append((unit.owner, unit.col, unit.hp))
+        for upgrade in self.upgrades:
+            lanes[upgrade.row].append((upgrade.kind, upgrade.col))
+        return [zlib.crc32(repr(sorted(lane)).encode()) for lane in lanes]
+
+    def update_resources(self):
+        self.resources["ammunition"] += self.production_rate["ammunition"] * self.resources["supply"]
+        self.resources["prodpoint"] += self.production_rate["prodpoint"] * self.resources["supply"]
+
+    def unit_at(self, row, col, exclude=None):
+        return self.index.unit_at(row, col, exclude)
+
+    def upgrade_at(self, row, col):
+        return self.index.upgrade_at(row, col)
+
+    def add_unit(self, unit):
+        if unit.owner == PLAYER:
+            self.players[unit] = None
+        else:
+            self.enemies[unit] = None
+        self.index.add_unit(unit)
+
+    def kill(self, unit):
+        if not unit.alive:
+            return
+        unit.alive = False
+        if unit.owner == PLAYER:
+            del self.players[unit]
+        else:
+            del self.enemies[unit]
+        self.index.remove_unit(unit)
+        self.emit("kill", unit)
+
+    def spawn_enemy(self):
+        row_enemies = self.index.row_enemies
+        if self.spawn_row is None:
+            potential_rows = [row for row in range(self.rows) if row_enemies[row] < 1]
+        else:
+            potential_rows = [self.spawn_row] if row_enemies[self.spawn_row] < 1 else []
+        if potential_rows:
+            row = self.rng.choice(potential_rows)
+            enemy = Unit(ENEMY, row, self.columns - 1)
+            self.add_unit(enemy)
+            self.emit("spawn", enemy)
+
+    def move_enemies(self):
+        for enemy in list(self.enemies):
+            if not enemy.alive:
+                continue
+            if enemy.hp <= 0:
+                self.kill(enemy)
+                continue
+            target_col = enemy.col - 1
+            if target_col < 0:
+                self.lost = True
+                return
+            occupant = self.index.unit_at(enemy.row, target_col)
+            if occupant and occupant.owner == ENEMY:
+                continue
+            target_player = occupant
+            if target_player:
+                damage = ENEMY_DAMAGE
+                if self.index.has_flag("protected", target_player.row, target_player.col):
+                    damage = BUNKER_DAMAGE
+                target_player.hp -= damage
+                enemy.hp -= PLAYER_DAMAGE
+                self.emit("damage", target_player)
+                self.emit("damage", enemy)
+                if target_player.hp <= 0:
+                    self.kill(target_player)
+                if enemy.hp <= 0:
+                    self.kill(enemy)
+            else:
+                enemy.prev_row, enemy.prev_col, enemy.moved_tick = enemy.row, enemy.col, self.scheduler.tick
+                self.index.move_unit(enemy, enemy.row, target_col)
+                self.emit("move", enemy)
+
+    def interpolate(self, unit):
+        if unit.moved_tick is None:
+            return None
+        progress = (self.scheduler.tick - unit.moved_tick + self.scheduler.alpha()) / self.move_ticks
+        if progress >= 1.0:
+            unit.moved_tick = None
+            return None
+        return (unit.prev_row + (unit.row - unit.prev_row) * progress,
+                unit.prev_col + (unit.col - unit.prev_col) * progress)
+
+    def direct_spawn(self, row):
+        if not 0 <= row < self.rows:
+            return False
+        self.spawn_row = row
+        return True
+
+    def place_card(self, row, col):
+        if not self.board.in_bounds(row, col) or col >= PLAYER_COLUMNS:
+            return None
+        if self.unit_at(row, col):
+            return None
+        if any(self.resources[name] < cost for name, cost in CARD_COST.items()):
+            return None
+        card = Unit(PLAYER, row, col)
+        self.add_unit(card)
+        for name, cost in CARD_COST.items():
+            self.resources[name] -= cost
+        self.emit("place_card", card)
+        return card
+
+    def move_card(self, from_row, from_col, row, col):
+        card = self.unit_at(from_row, from_col)
+        if card is None or card.owner != PLAYER:
+            return None
+        target = None
+        for d_row, d_col in [(0, 0)] + DROP_FALLBACKS:
+            new_row, new_col = row + d_row, col + d_col
+            if self.board.in_bounds(new_row, new_col) and not self.unit_at(new_row, new_col, exclude=card):
+                target = (new_row, min(new_col, PLAYER_COLUMNS - 1))
+                break
+        if target is None or self.unit_at(*target, exclude=card):
+            return None
+        self.index.move_unit(card, *target)
+        self.emit("move", card)
+        return card
+
+    def place_upgrade(self, kind, row, col):
+        tile = self.board.tile(row, col)
+        if tile is None or not upgrade_allowed(kind, col) or self.upgrade_at(row, col):
+            return None
+        cost = UPGRADE_COSTS[kind]
+        if self.resources["prodpoint"] < cost:
+            return None
+        upgrade = Upgrade(kind, row, col)
+        tile.apply_upgrade(kind, self.resources)
+        if tile.protected:
+            self.index.set_flag("protected", row, col)
+        self.resources["prodpoint"] -= cost
+        self.upgrades.append(upgrade)
+        self.index.add_upgrade(upgrade)
+        self.emit("place_upgrade", upgrade)
+        return upgrade
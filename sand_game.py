@@ -1,38 +1,337 @@
+import io
 import os
+import csv
 import sys
+import gzip
+import argparse
+import tempfile
 import time
-import random
+import queue
+import weakref
+import threading
 import pygame
 import json
+import mmap
+import struct
+import hashlib
+from collections import OrderedDict, deque
+try:
+    from pygame._sdl2.video import Window, Renderer, Texture
+except ImportError:
+    Window = Renderer = Texture = None
+from sand_engine import Engine, PlaceCard, MoveCard, PlaceUpgrade, DirectSpawn, PLAYER, ENEMY
+import sand_net
 
-pygame.init()
 SCREEN_WIDTH = 1000
 SCREEN_HEIGHT = 600
 TILE_SIZE = 100
 MENU_WIDTH = 275
 MENU_PADDING = 10
 FPS = 60
+ZOOM_LEVELS = (0.25, 0.5, 1.0)
+CAMERA_KEYS = {pygame.K_LEFT: (-1, 0), pygame.K_RIGHT: (1, 0), pygame.K_UP: (0, -1), pygame.K_DOWN: (0, 1)}
+RENDER_MODES = ("full", "dirty")
+DIRTY_MERGE_SLACK = 2500
+UI_CELL_SIZE = 50
+SPEED_LABELS = ("<<", "| |", ">>")
+PROFILER_KEY = pygame.K_F3
+PROFILER_DUMP_KEY = pygame.K_F4
+PROFILER_PHASES = ("events", "update", "draw", "flip", "tick")
+PROFILER_SECONDS = 10
+PROFILER_GRAPH_FRAMES = 120
+PROFILER_REFRESH_FRAMES = 10
+AUTOSAVE_PERIOD = 30.0
+QUICKSAVE_KEY = pygame.K_F5
+QUICKLOAD_KEY = pygame.K_F9
+MEMORY_KEY = pygame.K_F6
+MEMORY_TOP_ASSETS = 8
+REPLAY_VERSION = 2
+REPLAY_EVENTS = (pygame.KEYDOWN, pygame.KEYUP, pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP,
+                 pygame.MOUSEMOTION, pygame.MOUSEWHEEL)
+REPLAY_ATTRS = ("key", "mod", "pos", "rel", "buttons", "button", "x", "y")
+TOP_PANEL_HEIGHT = 40
 WHITE = (255, 255, 255)
 BLACK = (0, 0, 0)
 HP_COLOR = RED = (255, 0, 0)
 GREEN = (0, 255, 0)
 GRAY = (128, 128, 128)
-
-
-def load_image(name, colorkey=None):
-    fullname = os.path.join('../pygamehoi5test/data', name)
-    if not os.path.isfile(fullname):
-        print(f"Файл с изображением '{fullname}' не найден")
-        sys.exit()
-    image = pygame.image.load(fullname)
+PANEL_COLOR = (40, 40, 40)
+FPS_CAPS = (30, 60, 120, 144, 0)
+SETTINGS_DEFAULTS = {"volume": 100, "fps_cap": FPS, "vsync": False, "scaled": False, "low_quality": False,
+                     "renderer": "software", "render_mode": "full"}
+RENDERERS = ("software", "texture")
+SETTINGS_SAVE_DELAY = 1.0
+
+
+ASSET_CACHE_BUDGET = 96 * 1024 * 1024
+
+
+class AssetCache:
+    def __init__(self, budget=ASSET_CACHE_BUDGET):
+        self.budget = budget
+        self.entries = OrderedDict()
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.scene = None
+        self.owners = {}
+        self.evicted = weakref.WeakValueDictionary()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            surface = self.evicted.get(key)
+            if surface is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.claim(key)
+            return self.put(key, surface)
+        self.hits += 1
+        self.entries.move_to_end(key)
+        self.claim(key)
+        surface, converted = entry
+        if not converted and pygame.display.get_surface() is not None:
+            surface = self.put(key, convert_surface(surface, key[2]))
+        return surface
+
+    def put(self, key, surface, claim=True):
+        self.discard(key)
+        self.evicted.pop(key, None)
+        converted = pygame.display.get_surface() is not None
+        self.entries[key] = (surface, converted)
+        self.used += surface_size(surface)
+        if claim:
+            self.claim(key)
+        while self.used > self.budget and len(self.entries) > 1:
+            old_key = next(iter(self.entries))
+            self.evicted[old_key] = self.entries[old_key][0]
+            self.discard(old_key)
+            self.evictions += 1
+        return surface
+
+    def claim(self, key):
+        if self.scene is not None:
+            self.owners.setdefault(key, set()).add(self.scene)
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.used -= surface_size(entry[0])
+
+    def clear(self):
+        self.entries.clear()
+        self.evicted.clear()
+        self.owners.clear()
+        self.used = 0
+
+    def report(self):
+        assets = {}
+        scenes = {}
+        held = list(self.evicted.items())
+        for key in [key for key in self.owners if key not in self.entries and key not in self.evicted]:
+            del self.owners[key]
+        for key, surface in [(key, entry[0]) for key, entry in self.entries.items()] + held:
+            size = surface_size(surface)
+            name = os.path.basename(key[0])
+            assets[name] = assets.get(name, 0) + size
+            for scene in self.owners.get(key, ()):
+                scenes[scene] = scenes.get(scene, 0) + size
+        held_size = sum(surface_size(surface) for key, surface in held)
+        return {"total": self.used + held_size, "cached": self.used, "held": held_size, "held_count": len(held),
+                "assets": assets, "scenes": scenes}
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "bytes": self.used, "budget": self.budget}
+
+
+ASSETS = AssetCache()
+
+
+def surface_size(surface):
+    return surface.get_pitch() * surface.get_height()
+
+
+def convert_surface(image, colorkey=None):
     if colorkey is not None:
         image = image.convert()
         if colorkey == -1:
             colorkey = image.get_at((0, 0))
         image.set_colorkey(colorkey)
+    elif pygame.display.get_surface() is not None:
+        image = image.convert_alpha()
     return image
 
 
+def image_key(name, size=None, colorkey=None):
+    return os.path.join('../pygamehoi5test/data', name), tuple(size) if size else None, colorkey
+
+
+def fit_image(name, image):
+    sizes = ASSET_SIZES.get(BAKED.source(name))
+    if not sizes or None in sizes:
+        return image
+    width = min(image.get_width(), max(size[0] for size in sizes))
+    height = min(image.get_height(), max(size[1] for size in sizes))
+    if (width, height) == image.get_size():
+        return image
+    return pygame.transform.scale(image, (width, height))
+
+
+def scale_image(image, size):
+    if size is None or image.get_size() == tuple(size):
+        return image
+    return pygame.transform.scale(image, size)
+
+
+def load_image(name, colorkey=None, size=None):
+    key = image_key(name, size, colorkey)
+    fullname = key[0]
+    image = ASSETS.get(key)
+    if image is not None:
+        return image
+    image = BAKED.load(fullname, key[1]) if colorkey is None else None
+    if image is None:
+        if not os.path.isfile(fullname):
+            print(f"Файл с изображением '{fullname}' не найден")
+            sys.exit()
+        image = scale_image(fit_image(fullname, pygame.image.load(fullname)), key[1])
+    return ASSETS.put(key, convert_surface(image, colorkey))
+
+
+BAKE_DIR = 'data/baked'
+BAKE_MANIFEST = 'manifest.json'
+BAKE_VERSION = 1
+
+
+def bake_key(source, size=None):
+    return f"{source}@{size[0]}x{size[1]}" if size else source
+
+
+def bake_name(source, size=None):
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return f"{stem}_{size[0]}x{size[1]}.rgba" if size else f"{stem}.rgba"
+
+
+def file_hash(path):
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+class BakedAssets:
+    def __init__(self, directory=BAKE_DIR):
+        self.directory = directory
+        self.entries = None
+        self.fresh = {}
+        self.maps = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.stale = 0
+
+    def manifest(self):
+        if self.entries is None:
+            entries = {}
+            try:
+                with open(resource_path(os.path.join(self.directory, BAKE_MANIFEST)), "r") as file:
+                    manifest = json.load(file)
+                if manifest.get("version") == BAKE_VERSION:
+                    entries = manifest["entries"]
+            except (OSError, ValueError, KeyError):
+                pass
+            self.entries = entries
+        return self.entries
+
+    def source(self, name):
+        return os.path.relpath(os.path.abspath(name), resource_path("")).replace(os.sep, "/")
+
+    def is_fresh(self, source, entry):
+        if source not in self.fresh:
+            fullname = resource_path(source)
+            try:
+                stat = os.stat(fullname)
+            except OSError:
+                fresh = True
+            else:
+                fresh = stat.st_size == entry["source_size"] and (stat.st_mtime_ns == entry["source_mtime"] or
+                                                                   file_hash(fullname) == entry["source_hash"])
+            if not fresh:
+                print(f"Baked '{source}' is stale, loading the source file")
+                self.stale += 1
+            self.fresh[source] = fresh
+        return self.fresh[source]
+
+    def covers(self, name, sizes):
+        source = self.source(name)
+        entries = self.manifest()
+        return all(bake_key(source, size) in entries and self.is_fresh(source, entries[bake_key(source, size)])
+                   for size in sizes)
+
+    def load(self, name, size=None):
+        source = self.source(name)
+        entry = self.manifest().get(bake_key(source, size))
+        if entry is None or not self.is_fresh(source, entry):
+            return None
+        width, height = entry["size"]
+        try:
+            with open(resource_path(os.path.join(self.directory, entry["blob"])), "rb") as file:
+                data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        if len(data) != width * height * 4:
+            data.close()
+            return None
+        surface = pygame.image.frombuffer(data, (width, height), "RGBA")
+        self.maps[surface] = data
+        self.hits += 1
+        return surface
+
+
+BAKED = BakedAssets()
+
+
+TEXT_CACHE_SIZE = 512
+
+
+class TextCache:
+    def __init__(self, max_entries=TEXT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def render(self, font, text, color, antialias=True):
+        key = (font, text, tuple(color), antialias)
+        surface = self.entries.get(key)
+        if surface is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return surface
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        self.entries[key] = surface
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return surface
+
+    def blit_number(self, surface, font, value, color, pos, antialias=True):
+        x, y = pos
+        for digit in str(value):
+            glyph = self.render(font, digit, color, antialias)
+            surface.blit(glyph, (x, y))
+            x += glyph.get_width()
+        return x - pos[0]
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
+
+    def used(self):
+        return sum(surface_size(surface) for surface in self.entries.values())
+
+
+TEXTS = TextCache()
+
+
 def resource_path(relative_path):
     try:
         base_path = sys._MEIPASS
@@ -48,17 +347,112 @@ def settings_path():
         return "data/settings.json"
 
 
-player_card = load_image(resource_path('data/green_toy.png'))
-enemy_card = load_image(resource_path('data/red_toy.png'))
-dirt_tile = load_image(resource_path('data/dirt.png'))
-placable_tile = load_image(resource_path('data/placable_dirt.png'))
-parking_lot_tile = load_image(resource_path('data/parking_lot.png'))
-supply_truck = load_image(resource_path('data/truck.png'))
-bunker = load_image(resource_path('data/bunker_gray.png'))
-tile_images = {
-    "trencher": pygame.transform.scale(parking_lot_tile, (TILE_SIZE, TILE_SIZE)),
-    "trench": pygame.transform.scale(placable_tile, (TILE_SIZE, TILE_SIZE)),
-    "dirt": pygame.transform.scale(dirt_tile, (TILE_SIZE, TILE_SIZE))
+def save_path():
+    if getattr(sys, 'frozen', False):
+        return os.path.join(os.path.dirname(sys.executable), "autosave.sav")
+    else:
+        return "data/autosave.sav"
+
+
+def write_atomic(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp_", suffix=os.path.basename(path))
+    try:
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class AutoSaver:
+    def __init__(self, path):
+        self.path = path
+        self.pending = None
+        self.saves = 0
+        self.lock = threading.Lock()
+        self.writing = threading.Lock()
+        self.wake = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def save(self, data):
+        with self.lock:
+            self.pending = data
+        self.wake.set()
+
+    def take(self):
+        with self.lock:
+            data, self.pending = self.pending, None
+        return data
+
+    def run(self):
+        while True:
+            self.wake.wait()
+            self.wake.clear()
+            with self.writing:
+                data = self.take()
+                if data is not None:
+                    try:
+                        write_atomic(self.path, data)
+                        self.saves += 1
+                    except OSError as error:
+                        print(f"Autosave failed: {error}")
+
+    def flush(self):
+        with self.writing:
+            data = self.take()
+            if data is not None:
+                write_atomic(self.path, data)
+                self.saves += 1
+
+
+TILE_FILES = {
+    "trencher": 'data/parking_lot.png',
+    "trench": 'data/placable_dirt.png',
+    "dirt": 'data/dirt.png'
+}
+SOUND_FILES = {
+    "pause": 'data/pause_button.wav',
+    "button": 'data/button_press.wav',
+    "restart": 'data/restart.wav',
+    "enemy_spawn": 'data/enemy_spawn.wav',
+    "card_place": 'data/card_place.wav',
+    "truck_place": 'data/truck_place.wav',
+    "bunker_place": 'data/bunker_place.wav'
+}
+SOUND_GROUPS = {
+    "ui": ("button", "pause", "restart"),
+    "spawn": ("enemy_spawn",),
+    "place": ("card_place", "truck_place", "bunker_place"),
+}
+SOUND_VOICES = {"ui": 2, "spawn": 2, "place": 3}
+SOUND_COOLDOWNS = {"enemy_spawn": 0.2, "card_place": 0.05, "truck_place": 0.05, "bunker_place": 0.05}
+STARTING_SCREEN_IMAGES = ['data/starting_screen.jpg', 'data/up_logo.png', 'data/starting_screen_button.png',
+                          'data/settings_icon.png']
+PRELOAD_IMAGES = STARTING_SCREEN_IMAGES + [
+    'data/green_toy.png', 'data/red_toy.png', 'data/truck.png', 'data/bunker_gray.png', *TILE_FILES.values(),
+    'data/png1.png', 'data/png2.png', 'data/png3.png', 'data/settings_fon.jpg',
+    *[f'data/tutorial_{i}.jpg' for i in range(1, 6)]
+]
+ZOOM_TILE_SIZES = [(int(TILE_SIZE * zoom), int(TILE_SIZE * zoom)) for zoom in ZOOM_LEVELS]
+ASSET_SIZES = {
+    'data/starting_screen.jpg': [(SCREEN_WIDTH, SCREEN_HEIGHT)],
+    'data/settings_fon.jpg': [(SCREEN_WIDTH, SCREEN_HEIGHT)],
+    **{f'data/tutorial_{i}.jpg': [(SCREEN_WIDTH, SCREEN_HEIGHT)] for i in range(1, 6)},
+    'data/up_logo.png': [(600, 190)],
+    'data/starting_screen_button.png': [(265, 65)],
+    'data/settings_icon.png': [(50, 50)],
+    'data/icon.png': [None],
+    'data/png1.png': [(30, 30)],
+    'data/png2.png': [(30, 30)],
+    'data/png3.png': [(20, 20), (30, 30)],
+    **{path: ZOOM_TILE_SIZES for path in [*TILE_FILES.values(), 'data/green_toy.png', 'data/red_toy.png',
+                                          'data/truck.png', 'data/bunker_gray.png']},
 }
 
 
@@ -70,28 +464,326 @@ def load_sound(name):
     return pygame.mixer.Sound(fullname)
 
 
-SOUNDS = {
-    "pause": load_sound(resource_path('data/pause_button.wav')),
-    "button": load_sound(resource_path('data/button_press.wav')),
-    "restart": load_sound(resource_path('data/restart.wav')),
-    "enemy_spawn": load_sound(resource_path('data/enemy_spawn.wav')),
-    "card_place": load_sound(resource_path('data/card_place.wav')),
-    "truck_place": load_sound(resource_path('data/truck_place.wav')),
-    "bunker_place": load_sound(resource_path('data/bunker_place.wav'))
-}
+class AssetRegistry:
+    def __init__(self, loader, files, prepare=None):
+        self.loader = loader
+        self.files = files
+        self.prepare = prepare
+        self.items = {}
+        self.loads = 0
 
+    def __getitem__(self, name):
+        if name not in self.items:
+            self.store(name, self.loader(resource_path(self.files[name])))
+        return self.items[name]
 
-def load_settings():
-    try:
-        with open(settings_path(), "r") as file:
-            return json.load(file)
-    except FileNotFoundError:
-        return {"volume": 100}
+    def __contains__(self, name):
+        return name in self.items
+
+    def store(self, name, item):
+        if name in self.items:
+            return
+        if item is not None and self.prepare:
+            self.prepare(item)
+        self.items[name] = item
+        self.loads += 1
+
+    def loaded(self):
+        return [item for item in self.items.values() if item is not None]
+
+
+SOUNDS = AssetRegistry(load_sound, SOUND_FILES)
+
+
+class SoundManager:
+    def __init__(self, sounds, groups=SOUND_GROUPS, voices=SOUND_VOICES, cooldowns=SOUND_COOLDOWNS):
+        self.sounds = sounds
+        self.group_of = {name: group for group, names in groups.items() for name in names}
+        self.voices = voices
+        self.cooldowns = cooldowns
+        self.channels = None
+        self.last_played = {}
+        self.volume = 1.0
+        self.played = 0
+        self.dropped = 0
+
+    def reserve(self):
+        if self.channels is None:
+            if not pygame.mixer.get_init():
+                return False
+            total = sum(self.voices.values())
+            pygame.mixer.set_num_channels(max(pygame.mixer.get_num_channels(), total))
+            pygame.mixer.set_reserved(total)
+            self.channels = {}
+            first = 0
+            for group, count in self.voices.items():
+                self.channels[group] = [pygame.mixer.Channel(first + i) for i in range(count)]
+                first += count
+            self.apply_volume()
+        return True
+
+    def set_volume(self, volume):
+        volume = volume / 100
+        if volume != self.volume:
+            self.volume = volume
+            if self.channels:
+                self.apply_volume()
+
+    def apply_volume(self):
+        for channels in self.channels.values():
+            for channel in channels:
+                channel.set_volume(self.volume)
+
+    def play(self, name):
+        now = time.perf_counter()
+        if now - self.last_played.get(name, float("-inf")) < self.cooldowns.get(name, 0):
+            self.dropped += 1
+            return None
+        if not self.reserve():
+            return None
+        sound = self.sounds[name]
+        if sound is None:
+            return None
+        channel = next((channel for channel in self.channels[self.group_of[name]] if not channel.get_busy()), None)
+        if channel is None:
+            self.dropped += 1
+            return None
+        self.last_played[name] = now
+        channel.play(sound)
+        self.played += 1
+        return channel
+
+
+AUDIO = SoundManager(SOUNDS)
+
+
+class BackgroundLoader:
+    def __init__(self, images, sounds=()):
+        self.jobs = [("image", name) for name in images] + [("sound", name) for name in sounds]
+        self.total = len(self.jobs)
+        self.done = 0
+        self.completed = set()
+        self.results = queue.Queue()
+        self.thread = threading.Thread(target=self.work, daemon=True)
+        self.thread.start()
+
+    def work(self):
+        for kind, name in self.jobs:
+            result = None
+            try:
+                if kind == "image":
+                    result = self.load_image(name)
+                elif name not in SOUNDS:
+                    result = load_sound(resource_path(SOUND_FILES[name]))
+            except (OSError, pygame.error):
+                result = None
+            self.results.put((kind, name, result))
+
+    def load_image(self, name):
+        fullname = resource_path(name)
+        sizes = ASSET_SIZES.get(name, [None])
+        if BAKED.covers(fullname, sizes):
+            return [(image_key(fullname, size), BAKED.load(fullname, size)) for size in sizes]
+        if all(image_key(fullname, size) in ASSETS.entries for size in sizes):
+            return None
+        with open(fullname, "rb") as file:
+            image = fit_image(fullname, pygame.image.load(io.BytesIO(file.read()), fullname))
+        return [(image_key(fullname, size), scale_image(image, size)) for size in sizes]
+
+    def pump(self):
+        while True:
+            try:
+                kind, name, result = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.done += 1
+            self.completed.add(name)
+            if result is None:
+                continue
+            if kind == "image":
+                for key, surface in result:
+                    if surface is not None and key not in ASSETS.entries:
+                        ASSETS.put(key, convert_surface(surface), claim=False)
+            else:
+                SOUNDS.store(name, result)
+        return self.progress()
+
+    def progress(self):
+        return self.done / self.total if self.total else 1.0
+
+    def finished(self):
+        return self.done >= self.total
+
+    def ready(self, images):
+        return all(name in self.completed for name in images)
+
+
+loader = None
+
+
+def start_loader():
+    global loader
+    if loader is None:
+        loader = BackgroundLoader(PRELOAD_IMAGES)
+    return loader
+
+
+def pump_assets():
+    if loader is not None and not loader.finished():
+        loader.pump()
+
+
+class SettingsStore:
+    def __init__(self, path):
+        self.path = path
+        self.values = dict(SETTINGS_DEFAULTS)
+        self.overrides = {}
+        self.changed_at = None
+
+    def load(self):
+        try:
+            with open(self.path, "r") as file:
+                self.values.update(json.load(file))
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        return self.values
+
+    def __getitem__(self, key):
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.values[key]
+
+    def override(self, key, value):
+        self.overrides[key] = value
+
+    def set(self, key, value):
+        self.overrides.pop(key, None)
+        if self.values.get(key) != value:
+            self.values[key] = value
+            self.changed_at = time.time()
+
+    def flush(self, force=False):
+        if self.changed_at is None:
+            return False
+        if not force and time.time() - self.changed_at < SETTINGS_SAVE_DELAY:
+            return False
+        write_atomic(self.path, json.dumps(self.values).encode())
+        self.changed_at = None
+        return True
+
+
+SETTINGS = SettingsStore(settings_path())
+
+
+def panel_surface(size, alpha=128):
+    if SETTINGS["low_quality"]:
+        surface = pygame.Surface(size)
+        if pygame.display.get_surface() is not None:
+            surface = surface.convert()
+        surface.fill(PANEL_COLOR)
+        return surface
+    surface = pygame.Surface(size, pygame.SRCALPHA)
+    surface.fill((0, 0, 0, alpha))
+    return surface
+
+
+def draw_rect(target, color, rect, width=0):
+    if isinstance(target, pygame.Surface):
+        pygame.draw.rect(target, color, rect, width)
+    else:
+        target.draw_rect(color, rect, width)
+
+
+def draw_circle(target, color, center, radius):
+    if isinstance(target, pygame.Surface):
+        pygame.draw.circle(target, color, center, radius)
+    else:
+        target.draw_circle(color, center, radius)
+
+
+class TextureCanvas:
+    def __init__(self, size, vsync=False):
+        if Renderer is None:
+            raise pygame.error("pygame._sdl2 is not available")
+        self.size = size
+        self.window = Window("Sand Line", size)
+        self.renderer = None
+        self.textures = weakref.WeakKeyDictionary()
+        self.circles = {}
+        self.uploads = 0
+        self.set_vsync(vsync)
+
+    def set_vsync(self, vsync):
+        if self.renderer is not None:
+            if self.vsync == vsync:
+                return
+            position = self.window.position
+            self.textures.clear()
+            self.renderer = None
+            self.window.destroy()
+            self.window = Window("Sand Line", self.size, position=position)
+        self.vsync = vsync
+        self.renderer = Renderer(self.window, accelerated=-1, vsync=vsync)
+        self.renderer.logical_size = self.size
+
+    def texture(self, surface):
+        texture = self.textures.get(surface)
+        if texture is None:
+            if not surface.get_width() or not surface.get_height():
+                return None
+            texture = self.textures[surface] = Texture.from_surface(self.renderer, surface)
+            self.uploads += 1
+        return texture
+
+    def get_size(self):
+        return self.size
+
+    def get_width(self):
+        return self.size[0]
+
+    def get_height(self):
+        return self.size[1]
+
+    def set_clip(self, rect):
+        pass
 
+    def blit(self, source, dest, area=None):
+        texture = self.texture(source)
+        if texture is None:
+            return
+        if area is None:
+            texture.draw(dstrect=dest)
+        else:
+            area = pygame.Rect(area)
+            texture.draw(srcrect=area, dstrect=(dest[0], dest[1], area.width, area.height))
 
-def save_settings(settings):
-    with open(settings_path(), "w") as file:
-        json.dump(settings, file)
+    def fill(self, color, rect=None):
+        self.renderer.draw_color = pygame.Color(color)
+        if rect is None:
+            self.renderer.clear()
+        else:
+            self.renderer.fill_rect(rect)
+
+    def draw_rect(self, color, rect, width=0):
+        self.renderer.draw_color = pygame.Color(color)
+        if width == 0:
+            self.renderer.fill_rect(rect)
+            return
+        rect = pygame.Rect(rect)
+        for i in range(width):
+            self.renderer.draw_rect(rect.inflate(-2 * i, -2 * i))
+
+    def draw_circle(self, color, center, radius):
+        key = (tuple(color), radius)
+        circle = self.circles.get(key)
+        if circle is None:
+            circle = pygame.Surface((radius * 2, radius * 2), pygame.SRCALPHA)
+            pygame.draw.circle(circle, color, (radius, radius), radius)
+            self.circles[key] = circle
+        self.blit(circle, (center[0] - radius, center[1] - radius))
+
+    def present(self):
+        self.renderer.present()
 
 
 class Button:
@@ -106,12 +798,12 @@ class Button:
         self.render_text()
 
     def render_text(self):
-        self.rendered_text = self.font.render(self.text, True, self.text_color)
+        self.rendered_text = TEXTS.render(self.font, self.text, self.text_color)
         self.text_rect = self.rendered_text.get_rect(center=self.rect.center)
 
     def draw(self, surface):
-        pygame.draw.rect(surface, self.bg_color, self.rect)
-        pygame.draw.rect(surface, self.border_color, self.rect, self.border_width)
+        draw_rect(surface, self.bg_color, self.rect)
+        draw_rect(surface, self.border_color, self.rect, self.border_width)
         surface.blit(self.rendered_text, self.text_rect)
 
     def is_clicked(self, event, offset=(0, 0)):
@@ -119,17 +811,85 @@ class Button:
         return event.type == pygame.MOUSEBUTTONDOWN and adjusted_rect.collidepoint(event.pos)
 
 
+class Widget:
+    def __init__(self, rect, handlers=None, active=None):
+        self.rect = pygame.Rect(rect)
+        self.handlers = handlers or {}
+        self.is_active = active
+        self.parent = None
+        self.children = []
+
+    def add(self, child):
+        child.parent = self
+        self.children.append(child)
+        return child
+
+    def active(self):
+        widget = self
+        while widget:
+            if widget.is_active and not widget.is_active():
+                return False
+            widget = widget.parent
+        return True
+
+    def walk(self):
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+class HitIndex:
+    def __init__(self, root, cell_size=UI_CELL_SIZE):
+        self.root = root
+        self.cell_size = cell_size
+        self.columns = root.rect.width // cell_size + 1
+        self.regions = {}
+        self.rebuild()
+
+    def cell_keys(self, rect):
+        rect = rect.clip(self.root.rect)
+        for row in range(rect.top // self.cell_size, (rect.bottom - 1) // self.cell_size + 1):
+            for col in range(rect.left // self.cell_size, (rect.right - 1) // self.cell_size + 1):
+                yield row * self.columns + col
+
+    def rebuild(self):
+        self.regions.clear()
+        for widget in self.root.walk():
+            for event_type in widget.handlers:
+                cells = self.regions.setdefault(event_type, {})
+                for key in self.cell_keys(widget.rect):
+                    cells.setdefault(key, []).insert(0, widget)
+
+    def move(self, widget, dx, dy):
+        for child in widget.walk():
+            child.rect.move_ip(dx, dy)
+        self.rebuild()
+
+    def dispatch(self, event):
+        cells = self.regions.get(event.type)
+        if cells is None or getattr(event, "button", 1) != 1:
+            return False
+        x, y = event.pos
+        if not self.root.rect.collidepoint(x, y):
+            return False
+        for widget in cells.get((y // self.cell_size) * self.columns + x // self.cell_size, ()):
+            if widget.rect.collidepoint(x, y) and widget.active():
+                widget.handlers[event.type](event)
+                return True
+        return False
+
+
 class ImageButton:
     def __init__(self, rect, image_path, text, font, text_color=WHITE):
         self.rect = pygame.Rect(rect)
-        self.image = pygame.transform.scale(load_image(image_path), (self.rect.width, self.rect.height))
+        self.image = load_image(image_path, size=self.rect.size)
         self.text = text
         self.font = font
         self.text_color = text_color
         self.render_text()
 
     def render_text(self):
-        self.rendered_text = self.font.render(self.text, True, self.text_color)
+        self.rendered_text = TEXTS.render(self.font, self.text, self.text_color)
         self.text_rect = self.rendered_text.get_rect(center=self.rect.center)
 
     def draw(self, surface):
@@ -140,323 +900,776 @@ class ImageButton:
         return event.type == pygame.MOUSEBUTTONDOWN and self.rect.collidepoint(event.pos)
 
 
-def starting_screen():
-    pygame.display.set_caption("Sand Line")
-    icon = load_image(resource_path('data/icon.png'))
-    pygame.display.set_icon(icon)
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-    clock = pygame.time.Clock()
-    background = pygame.transform.scale(load_image(resource_path('data/starting_screen.jpg')),
-                                        (SCREEN_WIDTH, SCREEN_HEIGHT))
-    logo = pygame.transform.scale(load_image(resource_path('data/up_logo.png')), (600, 190))
-    logo_rect = logo.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 3))
-    font = pygame.font.Font(resource_path('data/KarmaticArcade-6Yrp1.ttf'), 36)
-
-    button_width, button_height = 265, 65
-    play_button = ImageButton(((SCREEN_WIDTH - button_width) // 2, SCREEN_HEIGHT // 2, button_width, button_height),
-                              resource_path('data/starting_screen_button.png'), "Play", font, BLACK)
-    settings_button = ImageButton(
-        ((SCREEN_WIDTH - button_width) // 2, SCREEN_HEIGHT // 2 + 75, button_width, button_height),
-        resource_path('data/starting_screen_button.png'), "Settings", font, BLACK)
-    tutorial_button = ImageButton(
-        ((SCREEN_WIDTH - button_width) // 2, SCREEN_HEIGHT // 2 + 150, button_width, button_height),
-        resource_path('data/starting_screen_button.png'), "Tutorial", font, BLACK)
-    exit_button = ImageButton(
-        ((SCREEN_WIDTH - button_width) // 2, SCREEN_HEIGHT // 2 + 225, button_width, button_height),
-        resource_path('data/starting_screen_button.png'), "Exit", font, BLACK)
-    settings_icon_button = ImageButton((10, 545, 50, 50), resource_path('data/settings_icon.png'), "", font)
-
-    while True:
-        screen.blit(background, (0, 0))
-        screen.blit(logo, logo_rect)
-        play_button.draw(screen)
-        settings_button.draw(screen)
-        tutorial_button.draw(screen)
-        exit_button.draw(screen)
-        settings_icon_button.draw(screen)
-
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            elif play_button.is_clicked(event):
-                if SOUNDS["pause"]:
-                    SOUNDS["pause"].play()
+class Scene:
+    def __init__(self, manager):
+        self.manager = manager
+
+    def enter(self):
+        pass
+
+    def exit(self):
+        pass
+
+    def close(self):
+        pass
+
+    def handle_event(self, event):
+        pass
+
+    def update(self):
+        pass
+
+    def draw(self, screen):
+        pass
+
+    def frame(self, events):
+        for event in events:
+            self.handle_event(event)
+            if self.manager.top() is not self:
                 return
-            elif tutorial_button.is_clicked(event):
-                if SOUNDS["pause"]:
-                    SOUNDS["pause"].play()
-                tutorial_screen()
-
-            elif settings_button.is_clicked(event):
-                if SOUNDS["pause"]:
-                    SOUNDS["pause"].play()
-                settings_screen(screen)
-            elif exit_button.is_clicked(event):
-                if SOUNDS["pause"]:
-                    SOUNDS["pause"].play()
-                pygame.quit()
-                sys.exit()
-            elif settings_icon_button.is_clicked(event):
-                if SOUNDS["pause"]:
-                    SOUNDS["pause"].play()
-                settings_screen(screen)
-
-        pygame.display.flip()
-        clock.tick(FPS)
-
-
-def settings_screen(screen, on_back_callback=None):
-    clock = pygame.time.Clock()
-    font = pygame.font.Font(None, 36)
-    font_arc = pygame.font.Font(resource_path('data/KarmaticArcade-6Yrp1.ttf'), 60)
-    back_button = Button((50, 50, 150, 50), "Back", font)
-    main_menu_button = Button((50, 120, 150, 50), "Menu", font)
-    background = pygame.transform.scale(load_image(resource_path('data/settings_fon.jpg')),
-                                        (SCREEN_WIDTH, SCREEN_HEIGHT))
-    settings = load_settings()
-    current_volume = settings["volume"]
-
-    slider_width = 200
-    slider_height = 20
-    slider_x = SCREEN_WIDTH // 2 - slider_width // 2
-    slider_y = SCREEN_HEIGHT // 2
-    slider_rect = pygame.Rect(slider_x, slider_y, slider_width, slider_height)
-    handle_radius = 10
-    handle_x = slider_x + (current_volume / 100) * slider_width
-
-    dragging = False
-
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            elif event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    settings["volume"] = current_volume
-                    save_settings(settings)
-                    if on_back_callback:
-                        on_back_callback()
-                    return
-            elif main_menu_button.is_clicked(event):
-                if SOUNDS["button"]:
-                    SOUNDS["button"].play()
-                settings["volume"] = current_volume
-                save_settings(settings)
-                starting_screen()
-                if on_back_callback:
-                    on_back_callback()
+        pump_assets()
+        self.update()
+        self.draw(self.manager.screen)
+        self.manager.present()
+
+
+class SceneManager:
+    def __init__(self):
+        pygame.display.set_caption("Sand Line")
+        self.icon = load_image(resource_path('data/icon.png'))
+        pygame.display.set_icon(self.icon)
+        self.screen = None
+        self.canvas = None
+        if SETTINGS["renderer"] == "texture":
+            try:
+                self.canvas = TextureCanvas((SCREEN_WIDTH, SCREEN_HEIGHT), vsync=SETTINGS["vsync"])
+            except pygame.error as error:
+                print(f"Texture renderer not available, using software rendering: {error}")
+        self.apply_display()
+        self.clock = pygame.time.Clock()
+        self.factories = {}
+        self.scenes = {}
+        self.stack = []
+        self.layers = LayerCache()
+        self.memory_visible = False
+        self.memory_frames = 0
+        self.memory_font = pygame.font.Font(None, 18)
+
+    def apply_display(self):
+        if self.canvas:
+            self.canvas.set_vsync(SETTINGS["vsync"])
+            self.canvas.window.resizable = SETTINGS["scaled"]
+            self.canvas.window.set_icon(self.icon)
+            self.screen = self.canvas
+            return
+        flags = pygame.SCALED if SETTINGS["scaled"] or SETTINGS["vsync"] else 0
+        for flags, vsync in ((flags, int(SETTINGS["vsync"])), (flags, 0), (0, 0)):
+            try:
+                self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT), flags, vsync=vsync)
                 return
-            elif back_button.is_clicked(event):
-                if SOUNDS["pause"]:
-                    SOUNDS["pause"].play()
-                settings["volume"] = current_volume
-                save_settings(settings)
-                if on_back_callback:
-                    on_back_callback()
+            except pygame.error as error:
+                print(f"Display mode not available: {error}")
+
+    def present(self):
+        self.draw_memory(self.screen)
+        if self.canvas:
+            self.canvas.present()
+        else:
+            pygame.display.flip()
+
+    def draw_memory(self, screen):
+        if not self.memory_visible:
+            return None
+        self.memory_frames += 1
+        overlay, rect = self.memory_overlay()
+        screen.blit(overlay, rect)
+        return rect
+
+    def memory_overlay(self):
+        overlay = self.layers.get("memory", self.memory_frames // PROFILER_REFRESH_FRAMES, self.bake_memory)
+        return overlay, overlay.get_rect(bottomleft=(10, SCREEN_HEIGHT - 10))
+
+    def bake_memory(self):
+        report = ASSETS.report()
+        texts = TEXTS.used()
+        lines = [f"images {report['total'] // 1024} KiB in {len(ASSETS.entries)}  texts {texts // 1024} KiB  "
+                 f"total {(report['total'] + texts) // 1024} KiB",
+                 f"evicted but still referenced {report['held'] // 1024} KiB in {report['held_count']}"]
+        for scene, size in sorted(report["scenes"].items(), key=lambda item: -item[1]):
+            lines.append(f"scene {scene:10} {size // 1024:8} KiB")
+        for name, size in sorted(report["assets"].items(), key=lambda item: -item[1])[:MEMORY_TOP_ASSETS]:
+            lines.append(f"{name:26} {size // 1024:6} KiB")
+        line_height = self.memory_font.get_linesize()
+        overlay = panel_surface((420, 10 + len(lines) * line_height), 180)
+        pygame.draw.rect(overlay, WHITE, overlay.get_rect(), 1)
+        for i, line in enumerate(lines):
+            overlay.blit(self.memory_font.render(line, True, WHITE), (8, 5 + i * line_height))
+        return overlay
+
+    def register(self, name, factory):
+        self.factories[name] = factory
+
+    def get(self, name):
+        scene = self.scenes.get(name)
+        if scene is None:
+            ASSETS.scene = name
+            scene = self.scenes[name] = self.factories[name](self)
+            scene.name = name
+        return scene
+
+    def focus(self):
+        ASSETS.scene = self.stack[-1].name if self.stack else None
+
+    def top(self):
+        return self.stack[-1] if self.stack else None
+
+    def push(self, name):
+        if self.stack:
+            self.stack[-1].exit()
+        scene = self.get(name)
+        self.stack.append(scene)
+        self.focus()
+        scene.enter()
+
+    def pop(self):
+        self.stack.pop().exit()
+        self.focus()
+        if self.stack:
+            self.stack[-1].enter()
+
+    def switch(self, name):
+        if self.stack:
+            self.stack[-1].exit()
+        scene = self.get(name)
+        self.stack = [scene]
+        self.focus()
+        scene.enter()
+
+    def quit(self):
+        pygame.quit()
+        sys.exit()
+
+    def run(self, name):
+        self.switch(name)
+        try:
+            while self.stack:
+                events = pygame.event.get()
+                for event in events:
+                    if event.type == pygame.QUIT:
+                        self.quit()
+                    elif event.type == pygame.KEYDOWN and event.key == MEMORY_KEY:
+                        self.memory_visible = not self.memory_visible
+                self.stack[-1].frame(events)
+                SETTINGS.flush()
+                self.clock.tick(SETTINGS["fps_cap"])
+        finally:
+            for scene in self.scenes.values():
+                scene.close()
+            SETTINGS.flush(force=True)
+
+
+class LoadingScene(Scene):
+    def __init__(self, manager, images=STARTING_SCREEN_IMAGES, next_scene="menu"):
+        super().__init__(manager)
+        self.images = images
+        self.next_scene = next_scene
+        self.font = pygame.font.Font(None, 36)
+        self.bar = pygame.Rect(SCREEN_WIDTH // 4, SCREEN_HEIGHT // 2, SCREEN_WIDTH // 2, 20)
+        self.assets = None
+        self.progress = 0.0
+
+    def enter(self):
+        self.assets = start_loader()
+
+    def update(self):
+        self.progress = self.assets.pump()
+        if self.assets.ready(self.images) or self.assets.finished():
+            self.manager.switch(self.next_scene)
+
+    def frame(self, events):
+        self.update()
+        if self.manager.top() is self:
+            self.draw(self.manager.screen)
+            self.manager.present()
+
+    def draw(self, screen):
+        screen.fill(BLACK)
+        text = TEXTS.render(self.font, "Loading...", WHITE)
+        screen.blit(text, (self.bar.centerx - text.get_width() // 2, self.bar.y - 40))
+        draw_rect(screen, WHITE, self.bar, 2)
+        draw_rect(screen, WHITE, (self.bar.x, self.bar.y, int(self.bar.width * self.progress), self.bar.height))
+
+
+class MenuScene(Scene):
+    def __init__(self, manager):
+        super().__init__(manager)
+        self.background = load_image(resource_path('data/starting_screen.jpg'), size=(SCREEN_WIDTH, SCREEN_HEIGHT))
+        self.logo = load_image(resource_path('data/up_logo.png'), size=(600, 190))
+        self.logo_rect = self.logo.get_rect(center=(SCREEN_WIDTH // 2, SCREEN_HEIGHT // 3))
+        font = pygame.font.Font(resource_path('data/KarmaticArcade-6Yrp1.ttf'), 36)
+
+        button_width, button_height = 265, 65
+        x = (SCREEN_WIDTH - button_width) // 2
+        image = resource_path('data/starting_screen_button.png')
+        self.play_button = ImageButton((x, SCREEN_HEIGHT // 2, button_width, button_height), image, "Play", font, BLACK)
+        self.settings_button = ImageButton((x, SCREEN_HEIGHT // 2 + 75, button_width, button_height), image,
+                                           "Settings", font, BLACK)
+        self.tutorial_button = ImageButton((x, SCREEN_HEIGHT // 2 + 150, button_width, button_height), image,
+                                           "Tutorial", font, BLACK)
+        self.exit_button = ImageButton((x, SCREEN_HEIGHT // 2 + 225, button_width, button_height), image,
+                                       "Exit", font, BLACK)
+        self.settings_icon_button = ImageButton((10, 545, 50, 50), resource_path('data/settings_icon.png'), "", font)
+        self.buttons = [self.play_button, self.settings_button, self.tutorial_button, self.exit_button,
+                        self.settings_icon_button]
+
+    def handle_event(self, event):
+        for button in self.buttons:
+            if button.is_clicked(event):
+                AUDIO.play("pause")
+                if button is self.play_button:
+                    self.manager.switch("game")
+                elif button is self.tutorial_button:
+                    self.manager.push("tutorial")
+                elif button is self.exit_button:
+                    self.manager.quit()
+                else:
+                    self.manager.push("settings")
                 return
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                if slider_rect.collidepoint(event.pos):
-                    dragging = True
-                    if SOUNDS["button"]:
-                        SOUNDS["button"].play()
-            elif event.type == pygame.MOUSEBUTTONUP:
-                dragging = False
-            elif event.type == pygame.MOUSEMOTION and dragging:
-                handle_x = max(slider_x, min(event.pos[0], slider_x + slider_width))
-                current_volume = int(((handle_x - slider_x) / slider_width) * 100)
-                for sound in SOUNDS.values():
-                    if sound:
-                        sound.set_volume(current_volume / 100)
-
-        screen.blit(background, (0, 0))
-        text = font_arc.render("Settings", True, WHITE)
+
+    def draw(self, screen):
+        screen.blit(self.background, (0, 0))
+        screen.blit(self.logo, self.logo_rect)
+        for button in self.buttons:
+            button.draw(screen)
+
+
+class SettingsScene(Scene):
+    def __init__(self, manager):
+        super().__init__(manager)
+        self.font = pygame.font.Font(None, 36)
+        self.font_arc = pygame.font.Font(resource_path('data/KarmaticArcade-6Yrp1.ttf'), 60)
+        self.back_button = Button((50, 50, 150, 50), "Back", self.font)
+        self.main_menu_button = Button((50, 120, 150, 50), "Menu", self.font)
+        self.background = load_image(resource_path('data/settings_fon.jpg'), size=(SCREEN_WIDTH, SCREEN_HEIGHT))
+        self.slider_rect = pygame.Rect(SCREEN_WIDTH // 2 - 100, SCREEN_HEIGHT // 2, 200, 20)
+        self.handle_radius = 10
+        self.current_volume = SETTINGS["volume"]
+        self.dragging = False
+        self.option_buttons = [
+            Button((SCREEN_WIDTH // 2 - 225 + (i % 2) * 230, SCREEN_HEIGHT // 2 + 80 + (i // 2) * 50, 220, 40),
+                   "", self.font)
+            for i in range(4)
+        ]
+        self.label_options()
+
+    def label_options(self):
+        fps_cap = SETTINGS["fps_cap"]
+        labels = [f"FPS cap: {fps_cap or 'off'}", f"VSync: {'on' if SETTINGS['vsync'] else 'off'}",
+                  f"Scaled: {'on' if SETTINGS['scaled'] else 'off'}",
+                  f"Quality: {'low' if SETTINGS['low_quality'] else 'high'}"]
+        for button, label in zip(self.option_buttons, labels):
+            button.text = label
+            button.render_text()
+
+    def toggle_option(self, index):
+        if index == 0:
+            caps = list(FPS_CAPS)
+            current = SETTINGS["fps_cap"]
+            SETTINGS.set("fps_cap", caps[(caps.index(current) + 1) % len(caps)] if current in caps else FPS)
+        else:
+            key = ("vsync", "scaled", "low_quality")[index - 1]
+            SETTINGS.set(key, not SETTINGS[key])
+            if key != "low_quality":
+                self.manager.apply_display()
+        self.label_options()
+
+    def enter(self):
+        self.dragging = False
+
+    def exit(self):
+        SETTINGS.set("volume", self.current_volume)
+
+    def handle_event(self, event):
+        if event.type == pygame.KEYDOWN:
+            if event.key == pygame.K_ESCAPE:
+                self.manager.pop()
+        elif self.main_menu_button.is_clicked(event):
+            AUDIO.play("button")
+            self.manager.switch("menu")
+        elif self.back_button.is_clicked(event):
+            AUDIO.play("pause")
+            self.manager.pop()
+        elif event.type == pygame.MOUSEBUTTONDOWN:
+            if self.slider_rect.collidepoint(event.pos):
+                self.dragging = True
+                AUDIO.play("button")
+            for index, button in enumerate(self.option_buttons):
+                if button.rect.collidepoint(event.pos):
+                    AUDIO.play("button")
+                    self.toggle_option(index)
+        elif event.type == pygame.MOUSEBUTTONUP:
+            self.dragging = False
+        elif event.type == pygame.MOUSEMOTION and self.dragging:
+            handle_x = max(self.slider_rect.left, min(event.pos[0], self.slider_rect.right))
+            self.current_volume = int(((handle_x - self.slider_rect.left) / self.slider_rect.width) * 100)
+            AUDIO.set_volume(self.current_volume)
+
+    def draw(self, screen):
+        slider = self.slider_rect
+        screen.blit(self.background, (0, 0))
+        text = TEXTS.render(self.font_arc, "Settings", WHITE)
         screen.blit(text, (SCREEN_WIDTH // 2 - text.get_width() // 2, 100))
-        pygame.draw.rect(screen, GRAY, slider_rect)
-        pygame.draw.circle(screen, BLACK, (int(handle_x), slider_y + slider_height // 2), handle_radius)
-        volume_text = font.render(f"Volume: {current_volume}%", True, WHITE)
-        screen.blit(volume_text, (slider_x, slider_y + slider_height + 10))
-        back_button.draw(screen)
-        main_menu_button.draw(screen)
-        pygame.display.flip()
-        clock.tick(FPS)
+        draw_rect(screen, GRAY, slider)
+        handle_x = slider.left + (self.current_volume / 100) * slider.width
+        draw_circle(screen, BLACK, (int(handle_x), slider.centery), self.handle_radius)
+        volume_text = TEXTS.render(self.font, f"Volume: {self.current_volume}%", WHITE)
+        screen.blit(volume_text, (slider.left, slider.bottom + 10))
+        self.back_button.draw(screen)
+        self.main_menu_button.draw(screen)
+        for button in self.option_buttons:
+            button.draw(screen)
 
 
 #
+def merge_dirty_rects(rects, slack=DIRTY_MERGE_SLACK):
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        index = 0
+        while index < len(merged):
+            union = rect.union(merged[index])
+            if union.w * union.h <= rect.w * rect.h + merged[index].w * merged[index].h + slack:
+                rect = union
+                merged.pop(index)
+                index = 0
+            else:
+                index += 1
+        merged.append(rect)
+    return merged
+
+
 def draw_multiline_text(surface, text, pos, font, color):
     lines = text.split("\n")
     x, y = pos
     line_height = font.get_linesize()
     for line in lines:
-        rendered_text = font.render(line, True, color)
+        rendered_text = TEXTS.render(font, line, color)
         surface.blit(rendered_text, (x, y))
         y += line_height
 
 
-def tutorial_screen():
-    clock = pygame.time.Clock()
-    font = pygame.font.Font(None, 36)
-    font_tut = pygame.font.Font(None, 24)
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-
-    backgrounds = [
-        pygame.transform.scale(load_image(resource_path(f'data/tutorial_{i}.jpg')), (SCREEN_WIDTH, SCREEN_HEIGHT))
-        for i in range(1, 6)
-    ]
-
-    tutorial_texts = [
-        "Press S to open and close upgrade menu\nPress SPACE to pause the game\nPress ESC to open settings\n\n\n\nНажмите S для открытия и закрытия\nменю апгрейдов\nПоставьте паузу, нажав пробел\nНажмите ESC для открытия настроек",
-        "Place a solider by clicking on an\n empty tile on rows 1-4.\nEach soldier costs 15 production \nand 25 ammunition\n\n\nПоставьте солдатика, нажав\nна любую пустую клетку на рядах 1-4.\nКаждый солдатик стоит 15 продукции \nи 25 патронов",
-        "You can also drag your soldiers\nby clicking and holding them\n\n\nВы также можете перетаскивать\nсвоих солдатиков, зажав их\n",
-        "Truck can be placed on the first row\n. It increases your production\nIt should be placed first\n\n\nГрузовик ставится на первый ряд\nи увеличивает производимость.\nЕго следует ставить первым",
-        "Bunker increases defence of your soldier.\nIt can be placed anywhere on rows 2-4\n\n\nБункер увеличивает защиту вашего\nсолдатика. Он ставится на рядах 2-4",
-    ]
-    next_button = Button((SCREEN_WIDTH - 200, SCREEN_HEIGHT - 100, 150, 50), "Next", font)
-    prev_button = Button((SCREEN_WIDTH - 400, SCREEN_HEIGHT - 100, 150, 50), "Previous", font)
-    menu_button = Button((25, 25, 150, 50), "Menu", font)
-    page = 0
-    while True:
-        screen.blit(backgrounds[page], (0, 0))
-        draw_multiline_text(screen, tutorial_texts[page], (SCREEN_WIDTH // 1.5, SCREEN_HEIGHT // 7), font_tut, WHITE)
-        next_button.draw(screen)
-        prev_button.draw(screen)
-        menu_button.draw(screen)
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            elif menu_button.is_clicked(event):
-                if SOUNDS["button"]:
-                    SOUNDS["button"].play()
-                starting_screen()
-                return
-            elif next_button.is_clicked(event):
-                if SOUNDS["button"]:
-                    SOUNDS["button"].play()
-                if page < 4:
-                    page += 1
-                else:
-                    starting_screen()
-                    return
-            elif prev_button.is_clicked(event):
-                if SOUNDS["button"]:
-                    SOUNDS["button"].play()
-                if page > 0:
-                    page -= 1
-        pygame.display.flip()
-        clock.tick(FPS)
-
-
-TILE_TYPES = {
-    "trencher": pygame.transform.scale(parking_lot_tile, (TILE_SIZE, TILE_SIZE)),
-    "trench": pygame.transform.scale(placable_tile, (TILE_SIZE, TILE_SIZE)),
-    "dirt": pygame.transform.scale(dirt_tile, (TILE_SIZE, TILE_SIZE))
-}
+TUTORIAL_TEXTS = [
+    "Press S to open and close upgrade menu\nPress SPACE to pause the game\nPress ESC to open settings\n\n\n\nНажмите S для открытия и закрытия\nменю апгрейдов\nПоставьте паузу, нажав пробел\nНажмите ESC для открытия настроек",
+    "Place a solider by clicking on an\n empty tile on rows 1-4.\nEach soldier costs 15 production \nand 25 ammunition\n\n\nПоставьте солдатика, нажав\nна любую пустую клетку на рядах 1-4.\nКаждый солдатик стоит 15 продукции \nи 25 патронов",
+    "You can also drag your soldiers\nby clicking and holding them\n\n\nВы также можете перетаскивать\nсвоих солдатиков, зажав их\n",
+    "Truck can be placed on the first row\n. It increases your production\nIt should be placed first\n\n\nГрузовик ставится на первый ряд\nи увеличивает производимость.\nЕго следует ставить первым",
+    "Bunker increases defence of your soldier.\nIt can be placed anywhere on rows 2-4\n\n\nБункер увеличивает защиту вашего\nсолдатика. Он ставится на рядах 2-4",
+]
+
+
+class TutorialScene(Scene):
+    def __init__(self, manager):
+        super().__init__(manager)
+        font = pygame.font.Font(None, 36)
+        self.font_tut = pygame.font.Font(None, 24)
+        self.backgrounds = [
+            load_image(resource_path(f'data/tutorial_{i}.jpg'), size=(SCREEN_WIDTH, SCREEN_HEIGHT))
+            for i in range(1, 6)
+        ]
+        self.next_button = Button((SCREEN_WIDTH - 200, SCREEN_HEIGHT - 100, 150, 50), "Next", font)
+        self.prev_button = Button((SCREEN_WIDTH - 400, SCREEN_HEIGHT - 100, 150, 50), "Previous", font)
+        self.menu_button = Button((25, 25, 150, 50), "Menu", font)
+        self.page = 0
+
+    def enter(self):
+        self.page = 0
+
+    def handle_event(self, event):
+        if self.menu_button.is_clicked(event):
+            AUDIO.play("button")
+            self.manager.pop()
+        elif self.next_button.is_clicked(event):
+            AUDIO.play("button")
+            if self.page < len(TUTORIAL_TEXTS) - 1:
+                self.page += 1
+            else:
+                self.manager.pop()
+        elif self.prev_button.is_clicked(event):
+            AUDIO.play("button")
+            if self.page > 0:
+                self.page -= 1
 
+    def draw(self, screen):
+        screen.blit(self.backgrounds[self.page], (0, 0))
+        draw_multiline_text(screen, TUTORIAL_TEXTS[self.page], (SCREEN_WIDTH // 1.5, SCREEN_HEIGHT // 7),
+                            self.font_tut, WHITE)
+        self.next_button.draw(screen)
+        self.prev_button.draw(screen)
+        self.menu_button.draw(screen)
 
-class Tile(pygame.sprite.Sprite):
-    def __init__(self, tile_type, x, y):
-        super().__init__()
-        self.tile_type = tile_type
-        self.image = TILE_TYPES[tile_type]
-        self.rect = self.image.get_rect(topleft=(x, y))
-        self.upgrade_type = None
-        self.protected = False
 
-    def apply_upgrade(self, upgrade_type, resources):
-        if upgrade_type == "supply":
-            resources["supply"] += 1
-            self.upgrade_type = upgrade_type
-        elif upgrade_type == "bunker":
-            self.protected = True
-            self.upgrade_type = upgrade_type
+class LayerCache:
+    def __init__(self):
+        self.layers = {}
+
+    def get(self, name, key, build):
+        layer = self.layers.get(name)
+        if layer is None or layer[0] != key:
+            layer = (key, build())
+            self.layers[name] = layer
+        return layer[1]
+
+    def invalidate(self, name=None):
+        if name is None:
+            self.layers.clear()
+        else:
+            self.layers.pop(name, None)
+
+
+class FrameProfiler:
+    def __init__(self, seconds=PROFILER_SECONDS):
+        self.seconds = seconds
+        self.samples = deque()
+        self.visible = False
+        self.frames = 0
+        self.frame = None
+        self.frame_start = 0.0
+        self.last = 0.0
+
+    def begin_frame(self):
+        if self.frame is not None:
+            self.mark("tick")
+            self.end_frame()
+        self.frame_start = self.last = time.perf_counter()
+        self.frame = dict.fromkeys(PROFILER_PHASES, 0.0)
+
+    def mark(self, phase):
+        if self.frame is None:
+            return
+        now = time.perf_counter()
+        self.frame[phase] += now - self.last
+        self.last = now
+
+    def end_frame(self):
+        if self.frame is None:
+            return
+        now = time.perf_counter()
+        self.samples.append((now, now - self.frame_start, self.frame))
+        while now - self.samples[0][0] > self.seconds:
+            self.samples.popleft()
+        self.frame = None
+        self.frames += 1
+
+    def percentiles(self):
+        columns = {"frame": sorted(sample[1] for sample in self.samples)}
+        for phase in PROFILER_PHASES:
+            columns[phase] = sorted(sample[2][phase] for sample in self.samples)
+        stats = {}
+        for name, values in columns.items():
+            if values:
+                stats[name] = tuple(values[min(len(values) - 1, int(len(values) * q))] for q in (0.5, 0.95, 0.99))
+        return stats
+
+    def dump(self, path):
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(("time", "frame") + PROFILER_PHASES)
+            for timestamp, frame_time, phases in self.samples:
+                writer.writerow([f"{timestamp:.6f}", f"{frame_time:.6f}"] + [f"{phases[p]:.6f}" for p in PROFILER_PHASES])
+        return path
+
+
+def encode_event(event):
+    return [event.type, {name: value for name, value in event.dict.items() if name in REPLAY_ATTRS}]
+
+
+def decode_event(record):
+    event_type, attrs = record
+    return pygame.event.Event(event_type, {name: tuple(value) if isinstance(value, list) else value
+                                           for name, value in attrs.items()})
+
+
+class ReplayRecorder:
+    def __init__(self, path, engine):
+        self.file = gzip.open(path, "wt")
+        self.control = None
+        self.frames = 0
+        self.write({"version": REPLAY_VERSION, "seed": engine.seed, "board": [engine.rows, engine.columns]})
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+
+    def frame(self, events, dt, control):
+        encoded = []
+        for event in events:
+            if event.type == pygame.QUIT:
+                break
+            if event.type in REPLAY_EVENTS:
+                encoded.append(encode_event(event))
+        record = [round(dt, 6), encoded]
+        if control != self.control:
+            record.append(control)
+            self.control = control
+        self.write(record if len(record) > 2 or encoded else record[0])
+        self.frames += 1
+
+    def close(self, engine):
+        self.write({"frames": self.frames, "checksum": engine.checksum()})
+        self.file.close()
+
+
+def load_replay(path):
+    with gzip.open(path, "rt") as file:
+        header = json.loads(file.readline())
+        if header.get("version") != REPLAY_VERSION:
+            raise ValueError(f"Unsupported replay version: {header.get('version')}")
+        frames = []
+        footer = {}
+        for line in file:
+            record = json.loads(line)
+            if isinstance(record, dict):
+                footer = record
+            elif isinstance(record, list):
+                frames.append((record[0], [decode_event(event) for event in record[1]],
+                               record[2] if len(record) > 2 else None))
+            else:
+                frames.append((record, [], None))
+    return header, frames, footer
+
+
+class Camera:
+    def __init__(self, view_width, view_height, rows, columns, tile_size=TILE_SIZE):
+        self.view_width = view_width
+        self.view_height = view_height
+        self.rows = rows
+        self.columns = columns
+        self.base_tile_size = tile_size
+        self.zoom_index = ZOOM_LEVELS.index(1.0)
+        self.x = 0
+        self.y = 0
+        self.version = 0
+
+    @property
+    def zoom(self):
+        return ZOOM_LEVELS[self.zoom_index]
+
+    @property
+    def tile_size(self):
+        return int(self.base_tile_size * self.zoom)
+
+    def clamp(self):
+        max_x = max(0, self.columns * self.tile_size - self.view_width)
+        max_y = max(0, self.rows * self.tile_size - self.view_height)
+        self.x = min(max(self.x, 0), max_x)
+        self.y = min(max(self.y, 0), max_y)
+
+    def pan(self, dx, dy):
+        old = (self.x, self.y)
+        self.x += dx
+        self.y += dy
+        self.clamp()
+        if (self.x, self.y) != old:
+            self.version += 1
+
+    def zoom_by(self, step, pos):
+        zoom_index = min(max(self.zoom_index + step, 0), len(ZOOM_LEVELS) - 1)
+        if zoom_index == self.zoom_index:
+            return
+        world_x, world_y = self.screen_to_world(pos)
+        self.zoom_index = zoom_index
+        self.x = int(world_x * self.zoom) - pos[0]
+        self.y = int(world_y * self.zoom) - pos[1]
+        self.clamp()
+        self.version += 1
+
+    def screen_to_world(self, pos):
+        return int((pos[0] + self.x) / self.zoom), int((pos[1] + self.y) / self.zoom)
+
+    def world_to_screen(self, pos):
+        return int(pos[0] * self.zoom) - self.x, int(pos[1] * self.zoom) - self.y
+
+    def world_rect_to_screen(self, rect):
+        rect = pygame.Rect(rect)
+        return pygame.Rect(self.world_to_screen(rect.topleft), (int(rect.width * self.zoom), int(rect.height * self.zoom)))
+
+    def screen_to_cell(self, pos):
+        world_x, world_y = self.screen_to_world(pos)
+        return world_y // self.base_tile_size, world_x // self.base_tile_size
+
+    def visible_range(self):
+        tile_size = self.tile_size
+        first_row = self.y // tile_size
+        first_col = self.x // tile_size
+        last_row = min(self.rows, (self.y + self.view_height - 1) // tile_size + 1)
+        last_col = min(self.columns, (self.x + self.view_width - 1) // tile_size + 1)
+        return first_row, first_col, last_row, last_col
+
+    def visible_cells(self):
+        first_row, first_col, last_row, last_col = self.visible_range()
+        for row in range(first_row, last_row):
+            for col in range(first_col, last_col):
+                yield row, col
 
 
 class Grid:
-    def __init__(self, screen_width, screen_height, tile_size):
+    def __init__(self, board, tile_size):
+        self.board = board
         self.tile_size = tile_size
-        self.tile_group = pygame.sprite.Group()
-        for y in range(0, screen_height, tile_size):
-            for x in range(0, screen_width, tile_size):
-                if x < tile_size:
-                    tile_type = "trencher"
-                elif x < tile_size * 4:
-                    tile_type = "trench"
-                else:
-                    tile_type = "dirt"
-                new_tile = Tile(tile_type, x, y)
-                self.tile_group.add(new_tile)
+        self.layers = LayerCache()
+        self.version = 0
+        self.mipmaps = {zoom: self.bake_stamps(int(tile_size * zoom)) for zoom in ZOOM_LEVELS}
+
+    def invalidate(self):
+        self.version += 1
+
+    def bake_stamps(self, tile_size):
+        stamps = {}
+        for tile_type, path in TILE_FILES.items():
+            stamp = load_image(resource_path(path), size=(tile_size, tile_size)).copy()
+            pygame.draw.rect(stamp, WHITE, stamp.get_rect(), 1)
+            stamps[tile_type] = stamp
+        return stamps
+
+    def bake(self, zoom, first_row, first_col, last_row, last_col):
+        stamps = self.mipmaps[zoom]
+        tile_size = int(self.tile_size * zoom)
+        surface = pygame.Surface(((last_col - first_col) * tile_size, (last_row - first_row) * tile_size))
+        for row in range(first_row, last_row):
+            tiles = self.board.tiles[row]
+            y = (row - first_row) * tile_size
+            for col in range(first_col, last_col):
+                surface.blit(stamps[tiles[col].tile_type], ((col - first_col) * tile_size, y))
+        return surface
+
+    def draw(self, screen, camera):
+        first_row, first_col, last_row, last_col = visible = camera.visible_range()
+        key = (camera.zoom, visible, self.version)
+        layer = self.layers.get("tiles", key, lambda: self.bake(camera.zoom, *visible))
+        tile_size = camera.tile_size
+        screen.blit(layer, (first_col * tile_size - camera.x, first_row * tile_size - camera.y))
+
+
+class SpritePool:
+    def __init__(self):
+        self.free = {}
+        self.created = 0
+        self.reused = 0
 
-    def draw(self, screen):
-        self.tile_group.draw(screen)
-        for tile in self.tile_group:
-            pygame.draw.rect(screen, WHITE, tile.rect, 1)
+    def acquire(self, sprite_class, *args):
+        free = self.free.get(sprite_class)
+        if free:
+            sprite = free.pop()
+            sprite.reset(*args)
+            self.reused += 1
+            return sprite
+        self.created += 1
+        return sprite_class(*args)
+
+    def release(self, sprite):
+        sprite.kill()
+        self.free.setdefault(type(sprite), []).append(sprite)
+
+    def stats(self):
+        return {"created": self.created, "reused": self.reused,
+                "free": sum(len(free) for free in self.free.values())}
+
+
+SPRITE_POOL = SpritePool()
 
 
 class Card(pygame.sprite.Sprite):
+    source = None
+
     def __init__(self, x, y, hp=100):
         super().__init__()
+        self.image = load_image(resource_path(self.source), size=(TILE_SIZE, TILE_SIZE))
+        self.rect = self.image.get_rect()
+        self.reset(x, y, hp)
+
+    def reset(self, x, y, hp=100):
         self.hp = hp
-        self.image = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
-        self.rect = self.image.get_rect(topleft=(x, y))
+        self.unit = None
+        self.rect.topleft = (x, y)
+        self.x, self.y = x, y
 
     def update(self):
         pass
 
-    def draw_hp_bar(self, screen):
-        bar_width = TILE_SIZE - 10
-        bar_height = 10
-        bar_x = self.rect.x + 5
-        bar_y = self.rect.y + TILE_SIZE - bar_height - 5
+    def draw_hp_bar(self, screen, rect=None):
+        rect = rect or self.rect
+        margin = rect.width // 20
+        bar_width = rect.width - 2 * margin
+        bar_height = rect.width // 10
+        bar_x = rect.x + margin
+        bar_y = rect.y + rect.height - bar_height - margin
         hp_ratio = max(self.hp / 100, 0)
-        pygame.draw.rect(screen, WHITE, (bar_x, bar_y, bar_width, bar_height), 1)
+        draw_rect(screen, WHITE, (bar_x, bar_y, bar_width, bar_height), 1)
         inner_width = int(bar_width * hp_ratio)
-        pygame.draw.rect(screen, HP_COLOR, (bar_x, bar_y, inner_width, bar_height))
+        draw_rect(screen, HP_COLOR, (bar_x, bar_y, inner_width, bar_height))
 
 
 class PlayerCard(Card):
-    def __init__(self, x, y, hp=100):
-        super().__init__(x, y, hp)
-        self.image = pygame.transform.scale(player_card, (TILE_SIZE, TILE_SIZE))
-        self.rect = self.image.get_rect(topleft=(x, y))
+    source = 'data/green_toy.png'
 
 
 class EnemyCard(Card):
-    def __init__(self, x, y, hp=100):
-        super().__init__(x, y, hp)
-        self.image = pygame.transform.scale(enemy_card, (TILE_SIZE, TILE_SIZE))
-        self.rect = self.image.get_rect(topleft=(x, y))
+    source = 'data/red_toy.png'
+
+
+class ArrayWorldRenderer:
+    def __init__(self, world, tile_size=TILE_SIZE):
+        self.world = world
+        self.tile_size = tile_size
+        self.group = pygame.sprite.Group()
+
+    def draw(self, screen, first_row=0, first_col=0):
+        rows = screen.get_height() // self.tile_size + 1
+        columns = screen.get_width() // self.tile_size + 1
+        for sprite in self.group.sprites():
+            SPRITE_POOL.release(sprite)
+        for owner, lane, col, hp in self.world.visible(first_row, first_col, rows, columns):
+            card_class = EnemyCard if owner else PlayerCard
+            x = (col - first_col) * self.tile_size
+            y = (lane - first_row) * self.tile_size
+            self.group.add(SPRITE_POOL.acquire(card_class, x, y, hp))
+        self.group.draw(screen)
+        for sprite in self.group:
+            sprite.draw_hp_bar(screen)
 
 
 class Upgrade(pygame.sprite.Sprite):
-    def __init__(self, x, y, cost):
+    source = None
+    cost = 0
+
+    def __init__(self, x, y):
         super().__init__()
-        self.image = pygame.Surface((TILE_SIZE, TILE_SIZE), pygame.SRCALPHA)
-        self.rect = self.image.get_rect(topleft=(x, y))
-        self.cost = cost
+        self.image = load_image(resource_path(self.source), size=(TILE_SIZE, TILE_SIZE))
+        self.rect = self.image.get_rect()
+        self.reset(x, y)
+
+    def reset(self, x, y):
+        self.placed = False
+        self.rect.topleft = (x, y)
 
     def update(self):
         pass
 
-    def draw_hp_bar(self, screen):
+    def draw_hp_bar(self, screen, rect=None):
         pass
 
 
 class TruckUpgrade(Upgrade):
-    def __init__(self, x, y):
-        super().__init__(x, y, cost=150)
-        self.image = pygame.transform.scale(supply_truck, (TILE_SIZE, TILE_SIZE))
-        self.rect = self.image.get_rect(topleft=(x, y))
-        self.directions = [(0, 1), (0, -1)]
+    kind = "supply"
+    source = 'data/truck.png'
+    cost = 150
+    directions = ((0, 1), (0, -1))
 
 
 class BunkerUpgrade(Upgrade):
-    def __init__(self, x, y):
-        super().__init__(x, y, cost=300)
-        self.image = pygame.transform.scale(bunker, (TILE_SIZE, TILE_SIZE))
-        self.rect = self.image.get_rect(topleft=(x, y))
-        self.directions = []
+    kind = "bunker"
+    source = 'data/bunker_gray.png'
+    cost = 300
+    directions = ()
 
 
 class SlidingMenu:
@@ -467,12 +1680,14 @@ class SlidingMenu:
         self.x = -width
         self.target_x = -width
         self.open = False
+        self.layers = LayerCache()
+        self.truck_rect = pygame.Rect(20, 150, TILE_SIZE, TILE_SIZE)
+        self.bunker_rect = pygame.Rect(20, self.truck_rect.bottom + 20, TILE_SIZE, TILE_SIZE)
 
     def toggle(self):
         self.open = not self.open
         self.target_x = 0 if self.open else -self.width
-        if SOUNDS["button"]:
-            SOUNDS["button"].play()
+        AUDIO.play("button")
 
     def update(self):
         speed = 30
@@ -481,42 +1696,49 @@ class SlidingMenu:
         elif self.x > self.target_x:
             self.x = max(self.x - speed, self.target_x)
 
-    def draw(self, screen, resources, font):
-        menu_surface = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
-        menu_surface.fill((0, 0, 0, 128))
-        truck_icon = pygame.transform.scale(supply_truck, (TILE_SIZE, TILE_SIZE))
-        truck_icon_rect = truck_icon.get_rect(topleft=(20, 150))
+    def bake(self, font):
+        menu_surface = panel_surface((self.width, self.height))
+        truck_icon = load_image(resource_path('data/truck.png'), size=(TILE_SIZE, TILE_SIZE))
+        truck_icon_rect = self.truck_rect
         menu_surface.blit(truck_icon, truck_icon_rect.topleft)
-        truck_text = font.render("Supply Truck", True, WHITE)
+        truck_text = TEXTS.render(font, "Supply Truck", WHITE)
         menu_surface.blit(truck_text, (truck_icon_rect.right + 10, truck_icon_rect.y))
         resource_icon_size = 20
-        resource_icon1 = pygame.transform.scale(load_image(resource_path("data/png3.png")),
-                                                (resource_icon_size, resource_icon_size))
+        resource_icon1 = load_image(resource_path("data/png3.png"), size=(resource_icon_size, resource_icon_size))
         menu_surface.blit(resource_icon1, (truck_icon_rect.right + 10, truck_icon_rect.y + 30))
-        resource_text1 = font.render("150", True, WHITE)
+        resource_text1 = TEXTS.render(font, "150", WHITE)
         menu_surface.blit(resource_text1, (truck_icon_rect.right + 10 + resource_icon_size + 5, truck_icon_rect.y + 30))
 
-        bunker_icon = pygame.transform.scale(bunker, (TILE_SIZE, TILE_SIZE))
-        bunker_icon_rect = bunker_icon.get_rect(topleft=(20, truck_icon_rect.bottom + 20))
+        bunker_icon = load_image(resource_path('data/bunker_gray.png'), size=(TILE_SIZE, TILE_SIZE))
+        bunker_icon_rect = self.bunker_rect
         menu_surface.blit(bunker_icon, bunker_icon_rect.topleft)
-        bunker_text = font.render("Bunker", True, WHITE)
+        bunker_text = TEXTS.render(font, "Bunker", WHITE)
         menu_surface.blit(bunker_text, (bunker_icon_rect.right + 10, bunker_icon_rect.y))
-        resource_icon2 = pygame.transform.scale(load_image(resource_path("data/png3.png")),
-                                                (resource_icon_size, resource_icon_size))
+        resource_icon2 = load_image(resource_path("data/png3.png"), size=(resource_icon_size, resource_icon_size))
         menu_surface.blit(resource_icon2, (bunker_icon_rect.right + 10, bunker_icon_rect.y + 30))
-        resource_text2 = font.render("300", True, WHITE)
+        resource_text2 = TEXTS.render(font, "300", WHITE)
         menu_surface.blit(resource_text2,
                           (bunker_icon_rect.right + 10 + resource_icon_size + 5, bunker_icon_rect.y + 30))
 
-        screen.blit(menu_surface, (self.x, 0))
-        pygame.draw.rect(screen, WHITE, (self.x, 0, self.width, self.height), 3)
-        return truck_icon_rect.move(self.x, 0), bunker_icon_rect.move(self.x, 0)
+        pygame.draw.rect(menu_surface, WHITE, (0, 0, self.width, self.height), 3)
+        return menu_surface
+
+    def draw(self, screen, resources, font):
+        screen.blit(self.layers.get("panel", font, lambda: self.bake(font)), (self.x, 0))
 
 
 class Game:
-    def __init__(self):
+    def __init__(self, render_mode=None, seed=None, board_size=None, record=None, autosave=True,
+                 manager=None, net=None):
         pygame.init()
-        self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        self.manager = manager
+        render_mode = render_mode or SETTINGS["render_mode"]
+        if manager:
+            self.screen = manager.screen
+            if manager.canvas:
+                render_mode = "full"
+        else:
+            self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption("Sand Line")
         icon = load_image(resource_path('data/icon.png'))
         pygame.display.set_icon(icon)
@@ -529,429 +1751,663 @@ class Game:
         self.enemy_group = pygame.sprite.Group()
         self.upgrade_group = pygame.sprite.Group()
         self.placed_upgrades = pygame.sprite.Group()
-        self.grid = Grid(SCREEN_WIDTH, SCREEN_HEIGHT, TILE_SIZE)
-        self.resources = {"supply": 1, "ammunition": 200, "prodpoint": 150}
-        self.production_rate = {"ammunition": 4, "prodpoint": 5}
+        self.unit_sprites = {}
+        self.upgrade_sprites = {}
+        rows, columns = board_size or (SCREEN_HEIGHT // TILE_SIZE, SCREEN_WIDTH // TILE_SIZE)
+        if net:
+            rows, columns, seed = net.rows, net.columns, net.seed
+        self.engine = Engine(rows, columns, seed)
+        self.engine.listener = self.on_engine_event
+        self.lockstep = sand_net.Lockstep(self.engine, net) if net else None
+        self.grid = Grid(self.engine.board, TILE_SIZE)
+        self.camera = Camera(SCREEN_WIDTH, SCREEN_HEIGHT, rows, columns)
+        self.camera_version = self.camera.version
+        self.mouse_pos = (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
         self.last_update_time = time.time()
+        self.frame_dt = 0.0
+        self.recorder = ReplayRecorder(record, self.engine) if record else None
+        self.autosaver = AutoSaver(save_path()) if autosave else None
+        self.last_autosave = time.time()
         self.dragging_card = None
         self.drag_offset_x = 0
         self.drag_offset_y = 0
         self.dragging_card_original_pos = None
-        self.enemy_spawn_time = time.time()
-        self.enemy_move_time = time.time()
-        self.popup_active = False
         self.debug_menu_active = False
-        self.game_paused = False
         self.settings_active = False
         self.menu = SlidingMenu(MENU_WIDTH, SCREEN_HEIGHT, MENU_PADDING)
         self.menu_button = pygame.Rect(10, 4, 50, 30)
-        self.game_speed_multiplier = 1.0
         self.active_speed_button = None
-        self.restart_button = None
-
-    def update_resources(self):
-        if not self.game_paused:
-            current_time = time.time()
-            elapsed = (current_time - self.last_update_time) * self.game_speed_multiplier
-            if elapsed >= 1:
-                self.last_update_time = current_time
-                self.resources["ammunition"] += self.production_rate["ammunition"] * self.resources["supply"]
-                self.resources["prodpoint"] += self.production_rate["prodpoint"] * self.resources["supply"]
+        self.restart_button = Button((SCREEN_WIDTH // 4 - 50, SCREEN_HEIGHT // 4 + 50, 100, 50),
+                                     "Restart", self.font, bg_color=RED)
+        self.speed_buttons = [Button((SCREEN_WIDTH - 140 + i * 50, 10, 40, 40), label, self.font)
+                              for i, label in enumerate(SPEED_LABELS)]
+        self.outlined_rects = [self.menu_button] + [button.rect for button in self.speed_buttons]
+        self.layers = LayerCache()
+        self.profiler = FrameProfiler()
+        self.profiler_key = None
+        self.memory_rect = None
+        self.profiler_font = pygame.font.Font(None, 18)
+        self.render_mode = render_mode
+        self.dirty_rects = []
+        self.moving_units = {}
+        self.full_redraw = True
+        self.ui_state = None
+        self.menu_x = self.menu.x
+        self.ui = self.build_ui()
+
+    def build_ui(self):
+        click = pygame.MOUSEBUTTONDOWN
+        root = Widget((0, 0, SCREEN_WIDTH, SCREEN_HEIGHT))
+        root.add(Widget(root.rect, {click: lambda event: self.handle_card_placement(event.pos)},
+                        lambda: not self.popup_active and not self.menu.open))
+        root.add(Widget(root.rect, {click: lambda event: self.menu.toggle()},
+                        lambda: self.menu.open and not self.popup_active))
+        root.add(Widget(root.rect, {click: lambda event: None}, lambda: self.popup_active))
+        self.menu_widget = root.add(Widget((self.menu.x, 0, self.menu.width, self.menu.height),
+                                           {click: lambda event: None},
+                                           lambda: self.menu.open and not self.popup_active))
+        for upgrade_class, rect in ((TruckUpgrade, self.menu.truck_rect), (BunkerUpgrade, self.menu.bunker_rect)):
+            entry = self.menu_widget.add(Widget(rect.move(self.menu.x, 0)))
+            entry.handlers[click] = lambda event, upgrade_class=upgrade_class, entry=entry: \
+                self.start_upgrade_drag(upgrade_class, entry.rect, event.pos)
+        root.add(Widget(self.menu_button, {click: self.handle_menu_button}))
+        for button in self.speed_buttons:
+            root.add(Widget(button.rect, {click: lambda event, label=button.text: self.press_speed_button(label)}))
+        popup_origin = (SCREEN_WIDTH // 4, SCREEN_HEIGHT // 4)
+        root.add(Widget(self.restart_button.rect.move(popup_origin), {click: lambda event: self.restart()},
+                        lambda: self.popup_active))
+        return HitIndex(root)
+
+    def sync_ui(self):
+        offset = self.menu.x - self.menu_widget.rect.x
+        if offset:
+            self.ui.move(self.menu_widget, offset, 0)
+
+    @property
+    def resources(self):
+        return self.engine.resources
+
+    @property
+    def production_rate(self):
+        return self.engine.production_rate
+
+    @property
+    def popup_active(self):
+        return self.engine.lost
+
+    @popup_active.setter
+    def popup_active(self, value):
+        self.engine.lost = value
+
+    @property
+    def game_paused(self):
+        return self.engine.paused
+
+    @game_paused.setter
+    def game_paused(self, value):
+        self.engine.paused = value
+
+    @property
+    def game_speed_multiplier(self):
+        return self.engine.speed
+
+    @game_speed_multiplier.setter
+    def game_speed_multiplier(self, value):
+        self.engine.speed = value
+
+    def on_engine_event(self, event, item):
+        if event == "spawn":
+            self.add_unit_sprite(item, EnemyCard, self.enemy_group)
+            AUDIO.play("enemy_spawn")
+        elif event == "place_card":
+            self.add_unit_sprite(item, PlayerCard, self.player_group)
+            AUDIO.play("card_place")
+        elif event == "place_upgrade":
+            self.add_upgrade_sprite(item)
+            AUDIO.play("truck_place" if item.kind == "supply" else "bunker_place")
+        elif event == "move":
+            sprite = self.unit_sprites.get(item)
+            if sprite:
+                self.snap_to_unit(sprite)
+        elif event == "damage":
+            sprite = self.unit_sprites.get(item)
+            if sprite:
+                sprite.hp = item.hp
+                self.mark_world_dirty(sprite.rect)
+        elif event == "kill":
+            sprite = self.unit_sprites.pop(item, None)
+            if sprite:
+                if sprite is self.dragging_card:
+                    self.dragging_card = None
+                SPRITE_POOL.release(sprite)
+                self.mark_world_dirty(sprite.rect)
+        elif event in ("reset", "load"):
+            for sprite in self.all_sprites.sprites():
+                SPRITE_POOL.release(sprite)
+            self.unit_sprites.clear()
+            self.upgrade_sprites.clear()
+            self.dragging_card = None
+            self.full_redraw = True
+            if event == "load":
+                for unit in self.engine.players:
+                    self.add_unit_sprite(unit, PlayerCard, self.player_group)
+                for unit in self.engine.enemies:
+                    self.add_unit_sprite(unit, EnemyCard, self.enemy_group)
+                for upgrade in self.engine.upgrades:
+                    self.add_upgrade_sprite(upgrade)
+                self.active_speed_button = {5.0: ">>", 0.2: "<<"}.get(self.engine.speed)
+
+    def add_unit_sprite(self, unit, card_class, group):
+        sprite = SPRITE_POOL.acquire(card_class, unit.col * TILE_SIZE, unit.row * TILE_SIZE, unit.hp)
+        sprite.unit = unit
+        self.unit_sprites[unit] = sprite
+        self.all_sprites.add(sprite)
+        group.add(sprite)
+        self.mark_world_dirty(sprite.rect)
+        return sprite
+
+    def add_upgrade_sprite(self, item):
+        upgrade_class = TruckUpgrade if item.kind == "supply" else BunkerUpgrade
+        upgrade = SPRITE_POOL.acquire(upgrade_class, item.col * TILE_SIZE, item.row * TILE_SIZE)
+        upgrade.placed = True
+        self.upgrade_sprites[item] = upgrade
+        self.placed_upgrades.add(upgrade)
+        self.all_sprites.add(upgrade)
+        self.mark_world_dirty(upgrade.rect)
+        return upgrade
+
+    def snap_to_unit(self, sprite):
+        self.mark_world_dirty(sprite.rect)
+        sprite.rect.topleft = (sprite.unit.col * TILE_SIZE, sprite.unit.row * TILE_SIZE)
+        sprite.x, sprite.y = sprite.rect.topleft
+        self.mark_world_dirty(sprite.rect)
+
+    def unit_rect(self, sprite):
+        position = self.engine.interpolate(sprite.unit)
+        if position is None:
+            return sprite.rect
+        row, col = position
+        return pygame.Rect((round(col * TILE_SIZE), round(row * TILE_SIZE)), sprite.rect.size)
+
+    def mark_moving_dirty(self):
+        if self.engine.paused:
+            return
+        moving = {}
+        for unit in self.engine.enemies:
+            position = self.engine.interpolate(unit)
+            if position is not None:
+                moving[unit] = (round(position[0] * TILE_SIZE), round(position[1] * TILE_SIZE))
+        for unit in moving.keys() | self.moving_units.keys():
+            drawn = self.moving_units.get(unit, (unit.prev_row * TILE_SIZE, unit.prev_col * TILE_SIZE))
+            position = moving.get(unit, (unit.row * TILE_SIZE, unit.col * TILE_SIZE))
+            if position == drawn:
+                continue
+            for top, left in (drawn, position):
+                self.mark_world_dirty((left, top, TILE_SIZE, TILE_SIZE))
+        self.moving_units = moving
+
+    def mark_dirty(self, rect):
+        if self.render_mode == "dirty":
+            self.dirty_rects.append(pygame.Rect(rect))
+
+    def mark_world_dirty(self, rect):
+        if self.render_mode == "dirty":
+            self.dirty_rects.append(self.camera.world_rect_to_screen(rect))
+
+    def collect_dirty(self):
+        if self.camera.version != self.camera_version:
+            self.camera_version = self.camera.version
+            self.full_redraw = True
+        ui_state = (tuple(self.resources.values()), self.game_paused, self.active_speed_button, self.popup_active)
+        if ui_state != self.ui_state:
+            if self.ui_state is None or ui_state[3] != self.ui_state[3]:
+                self.full_redraw = True
+            self.mark_dirty((0, 0, SCREEN_WIDTH, TOP_PANEL_HEIGHT + 10))
+            self.ui_state = ui_state
+        if self.menu.x != self.menu_x:
+            left = min(self.menu.x, self.menu_x)
+            self.mark_dirty((left, 0, self.menu.width + abs(self.menu.x - self.menu_x), self.menu.height))
+            self.menu_x = self.menu.x
+        if self.profiler.visible:
+            key = self.profiler.frames // PROFILER_REFRESH_FRAMES
+            if key != self.profiler_key:
+                self.profiler_key = key
+                self.mark_dirty(self.profiler_overlay()[1])
+        if self.manager and self.manager.memory_visible:
+            rect = self.manager.memory_overlay()[1]
+            if rect != self.memory_rect or self.manager.memory_frames % PROFILER_REFRESH_FRAMES == 0:
+                if self.memory_rect:
+                    self.mark_dirty(self.memory_rect)
+                self.mark_dirty(rect)
+                self.memory_rect = rect
+        self.mark_moving_dirty()
+
+    def execute(self, command):
+        if self.lockstep:
+            self.lockstep.queue(command)
+            return None
+        return self.engine.execute(command)
 
     def restart(self):
-        if SOUNDS["restart"]:
-            SOUNDS["restart"].play()
-        for sprite in self.all_sprites:
-            sprite.kill()
-        self.popup_active = False
-        self.resources = {"supply": 1, "ammunition": 200, "prodpoint": 150}
-        self.enemy_spawn_time = time.time()
-        self.enemy_move_time = time.time()
-
-    def place_upgrade(self, upgrade, valid_tile):
-        if isinstance(upgrade, BunkerUpgrade) and valid_tile.rect.x >= TILE_SIZE * 4:
-            upgrade.kill()
-            self.all_sprites.remove(upgrade)
-            self.placed_upgrades.remove(upgrade)
+        if self.lockstep:
             return
-        if isinstance(upgrade, TruckUpgrade) and valid_tile.rect.x != 0:
-            upgrade.kill()
-            self.all_sprites.remove(upgrade)
-            self.placed_upgrades.remove(upgrade)
-            return
-        if valid_tile and not any(upg.rect.topleft == valid_tile.rect.topleft for upg in self.placed_upgrades):
-            if self.resources["prodpoint"] >= upgrade.cost:
-                upgrade.rect.topleft = valid_tile.rect.topleft
-                if isinstance(upgrade, TruckUpgrade):
-                    valid_tile.apply_upgrade("supply", self.resources)
-                    if SOUNDS["truck_place"]:
-                        SOUNDS["truck_place"].play()
-                elif isinstance(upgrade, BunkerUpgrade):
-                    valid_tile.apply_upgrade("bunker", self.resources)
-                    if SOUNDS["bunker_place"]:
-                        SOUNDS["bunker_place"].play()
-                self.resources["prodpoint"] -= upgrade.cost
-                self.placed_upgrades.add(upgrade)
-                upgrade.placed = True
-                self.all_sprites.add(upgrade)
-            else:
-                self.all_sprites.remove(upgrade)
-                self.placed_upgrades.remove(upgrade)
-                upgrade.kill()
-        else:
-            self.all_sprites.remove(upgrade)
-            self.placed_upgrades.remove(upgrade)
-            upgrade.kill()
-
-    def spawn_enemy(self):
-        potential_rows = [y for y in range(0, SCREEN_HEIGHT, TILE_SIZE) if
-                          sum(1 for enemy in self.enemy_group if enemy.rect.y == y) < 1]
-        if potential_rows:
-            y_pos = random.choice(potential_rows)
-            new_enemy = EnemyCard(SCREEN_WIDTH - TILE_SIZE, y_pos)
-            self.all_sprites.add(new_enemy)
-            self.enemy_group.add(new_enemy)
-            if SOUNDS["enemy_spawn"]:
-                SOUNDS["enemy_spawn"].play()
-
-    def move_enemies(self):
-        for enemy in list(self.enemy_group):
-            if enemy.hp <= 0:
-                enemy.kill()
-                continue
-            target_x = enemy.rect.x - TILE_SIZE
-            if target_x < 0:
-                self.popup_active = True
-                return
-            if any(other.rect.y == enemy.rect.y and other.rect.x == target_x for other in self.enemy_group):
-                continue
-            target_player = None
-            for card in self.player_group:
-                if card.rect.x == target_x and card.rect.y == enemy.rect.y:
-                    target_player = card
-                    break
-            if target_player:
-                damage = 25
-                for tile in self.grid.tile_group:
-                    if tile.rect.topleft == target_player.rect.topleft and tile.protected:
-                        damage = 12
-                        break
-                target_player.hp -= damage
-                enemy.hp -= 40
-                if target_player.hp <= 0:
-                    target_player.kill()
-                if enemy.hp <= 0:
-                    enemy.kill()
-            else:
-                enemy.rect.x = target_x
-                enemy.x = enemy.rect.x
+        AUDIO.play("restart")
+        self.dragging_card = None
+        self.engine.reset()
+
+    def cell_at(self, world_pos):
+        return world_pos[1] // TILE_SIZE, world_pos[0] // TILE_SIZE
+
+    def start_drag(self, card, pos):
+        world_x, world_y = self.camera.screen_to_world(pos)
+        self.dragging_card = card
+        self.mark_world_dirty(card.rect)
+        self.dragging_card_original_pos = (card.rect.x, card.rect.y)
+        self.drag_offset_x = world_x - card.rect.x
+        self.drag_offset_y = world_y - card.rect.y
+
+    def start_upgrade_drag(self, upgrade_class, icon_rect, pos):
+        new_upgrade = SPRITE_POOL.acquire(upgrade_class, *self.camera.screen_to_world(icon_rect.topleft))
+        self.all_sprites.add(new_upgrade)
+        self.upgrade_group.add(new_upgrade)
+        self.start_drag(new_upgrade, pos)
+        self.menu.toggle()
 
     def handle_card_placement(self, pos):
-        for tile in self.grid.tile_group:
-            if tile.rect.collidepoint(pos):
-                if 0 <= tile.rect.x < TILE_SIZE * 4:
-                    occupied = any(card.rect.topleft == tile.rect.topleft for card in
-                                   self.player_group.sprites() + self.enemy_group.sprites())
-                    if not occupied and self.resources["ammunition"] >= 25 and self.resources["prodpoint"] >= 15:
-                        new_card = PlayerCard(tile.rect.x, tile.rect.y)
-                        self.all_sprites.add(new_card)
-                        self.player_group.add(new_card)
-                        self.resources["ammunition"] -= 25
-                        self.resources["prodpoint"] -= 15
-                        if SOUNDS["card_place"]:
-                            SOUNDS["card_place"].play()
-                        return
-                for card in self.player_group:
-                    if card.rect.collidepoint(pos):
-                        self.dragging_card = card
-                        self.dragging_card_original_pos = (card.rect.x, card.rect.y)
-                        self.drag_offset_x = pos[0] - card.rect.x
-                        self.drag_offset_y = pos[1] - card.rect.y
-                        return
+        row, col = self.camera.screen_to_cell(pos)
+        if self.lockstep and self.lockstep.side == ENEMY:
+            self.execute(DirectSpawn(row))
+            return
+        if self.execute(PlaceCard(row, col)):
+            return
+        unit = self.engine.unit_at(row, col)
+        if unit and unit.owner == PLAYER:
+            self.start_drag(self.unit_sprites[unit], pos)
 
     def handle_card_drag(self, pos):
         if self.dragging_card:
-            new_x = pos[0] - self.drag_offset_x
-            new_y = pos[1] - self.drag_offset_y
+            world_x, world_y = self.camera.screen_to_world(pos)
+            new_x = world_x - self.drag_offset_x
+            new_y = world_y - self.drag_offset_y
+            self.mark_world_dirty(self.dragging_card.rect)
             self.dragging_card.rect.topleft = (new_x, new_y)
+            self.mark_world_dirty(self.dragging_card.rect)
             self.dragging_card.x = new_x
             self.dragging_card.y = new_y
 
     def handle_card_drop(self):
         if not self.dragging_card:
             return
-        if isinstance(self.dragging_card, Upgrade):
-            valid_tile = None
-            for tile in self.grid.tile_group:
-                if tile.rect.collidepoint(self.dragging_card.rect.center):
-                    if not any(upg.rect.topleft == tile.rect.topleft for upg in self.placed_upgrades):
-                        valid_tile = tile
-                        break
-            if valid_tile:
-                self.place_upgrade(self.dragging_card, valid_tile)
-            else:
-                self.dragging_card.kill()
-            self.dragging_card = None
-            return
-        original_x, original_y = self.dragging_card_original_pos
-        valid_tile = None
-        for tile in self.grid.tile_group:
-            if tile.rect.collidepoint(self.dragging_card.rect.center):
-                occupied = any((other.rect.x == tile.rect.x and other.rect.y == tile.rect.y)
-                               for other in self.all_sprites if
-                               other != self.dragging_card and not isinstance(other, Upgrade))
-                if not occupied:
-                    valid_tile = tile
-                    break
-        if not valid_tile:
-            col = self.dragging_card.rect.centerx // TILE_SIZE
-            row = self.dragging_card.rect.centery // TILE_SIZE
-            candidates = []
-            directions = [(0, -1), (0, -2), (-1, 0), (1, 0)]
-            for d_row, d_col in directions:
-                new_row = row + d_row
-                new_col = col + d_col
-                if new_row < 0 or new_col < 0 or new_row >= (SCREEN_HEIGHT // TILE_SIZE) or new_col >= (
-                        SCREEN_WIDTH // TILE_SIZE):
-                    continue
-                tile_rect = pygame.Rect(new_col * TILE_SIZE, new_row * TILE_SIZE, TILE_SIZE, TILE_SIZE)
-                for tile in self.grid.tile_group:
-                    if tile.rect.topleft == tile_rect.topleft:
-                        occupied = any((other.rect.x == tile.rect.x and other.rect.y == tile.rect.y)
-                                       for other in self.all_sprites if
-                                       other != self.dragging_card and not isinstance(other, Upgrade))
-                        if not occupied:
-                            candidates.append(tile)
-                        break
-            if candidates:
-                valid_tile = candidates[0]
-        if valid_tile:
-            if valid_tile.rect.x <= TILE_SIZE * 3:
-                self.dragging_card.rect.topleft = valid_tile.rect.topleft
-                self.dragging_card.x, self.dragging_card.y = valid_tile.rect.x, valid_tile.rect.y
-            else:
-                self.dragging_card.rect.topleft = (TILE_SIZE * 3, valid_tile.rect.y)
-                self.dragging_card.x, self.dragging_card.y = TILE_SIZE * 3, valid_tile.rect.y
-        else:
-            self.dragging_card.rect.topleft = (original_x, original_y)
-            self.dragging_card.x, self.dragging_card.y = original_x, original_y
+        card = self.dragging_card
         self.dragging_card = None
+        row, col = self.cell_at(card.rect.center)
+        if isinstance(card, Upgrade):
+            SPRITE_POOL.release(card)
+            self.mark_world_dirty(card.rect)
+            self.execute(PlaceUpgrade(card.kind, row, col))
+            return
+        unit = card.unit
+        if not self.execute(MoveCard(unit.row, unit.col, row, col)):
+            self.snap_to_unit(card)
 
     def handle_menu_button(self, event):
-        if event.type == pygame.MOUSEBUTTONDOWN and event.button == 1:
-            if self.menu_button.collidepoint(event.pos):
-                self.menu.toggle()
+        if event.button == 1:
+            self.menu.toggle()
+
+    def draw_sprite(self, sprite, tile_size, world_rect=None):
+        rect = self.camera.world_rect_to_screen(world_rect or sprite.rect)
+        if tile_size == TILE_SIZE:
+            image = sprite.image
+        else:
+            image = load_image(resource_path(sprite.source), size=rect.size)
+        self.screen.blit(image, rect)
+        sprite.draw_hp_bar(self.screen, rect)
+
+    def draw_sprites(self):
+        tile_size = self.camera.tile_size
+        index = self.engine.index
+        for row, col in self.camera.visible_cells():
+            upgrade = index.upgrade_at(row, col)
+            if upgrade:
+                self.draw_sprite(self.upgrade_sprites[upgrade], tile_size)
+            unit = index.unit_at(row, col)
+            if unit:
+                sprite = self.unit_sprites[unit]
+                if sprite is not self.dragging_card:
+                    self.draw_sprite(sprite, tile_size, self.unit_rect(sprite))
+        for sprite in self.upgrade_group:
+            self.draw_sprite(sprite, tile_size)
+        if self.dragging_card and self.dragging_card.alive() and not isinstance(self.dragging_card, Upgrade):
+            self.draw_sprite(self.dragging_card, tile_size)
 
     def draw_menu_button(self):
-        pygame.draw.rect(self.screen, GRAY, self.menu_button)
-        pygame.draw.rect(self.screen, WHITE, self.menu_button, 2)
-        text = self.font.render("Buy", True, WHITE)
+        draw_rect(self.screen, GRAY, self.menu_button)
+        draw_rect(self.screen, WHITE, self.menu_button, 2)
+        text = TEXTS.render(self.font, "Buy", WHITE)
         self.screen.blit(text, (self.menu_button.x + 7, self.menu_button.y + 7))
 
     def draw_popup(self):
-        popup_surface = pygame.Surface((SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2), pygame.SRCALPHA)
-        popup_surface.fill((0, 0, 0, 128))
+        self.screen.blit(self.layers.get("popup", self.font, self.bake_popup), (SCREEN_WIDTH // 4, SCREEN_HEIGHT // 4))
+
+    def bake_popup(self):
+        popup_surface = panel_surface((SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2))
         pygame.draw.rect(popup_surface, WHITE, (0, 0, SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2), 3)
-        text = self.font.render("You've capitulated!", True, WHITE)
+        text = TEXTS.render(self.font, "You've capitulated!", WHITE)
         popup_surface.blit(text, (SCREEN_WIDTH // 4 - text.get_width() // 2, 50))
 
-        self.restart_button = Button(
-            (SCREEN_WIDTH // 4 - 50, SCREEN_HEIGHT // 4 + 50, 100, 50),
-            "Restart", self.font, bg_color=RED
-        )
         self.restart_button.draw(popup_surface)
-        self.screen.blit(popup_surface, (SCREEN_WIDTH // 4, SCREEN_HEIGHT // 4))
+        return popup_surface
 
     def draw_top_ui(self):
-        panel_x = 0
-        panel_y = 0
+        ui_surface = self.layers.get("top_ui", tuple(self.resources.values()), self.bake_top_ui)
+        self.screen.blit(ui_surface, (0, 0))
+
+    def bake_top_ui(self):
         panel_width = SCREEN_WIDTH
-        panel_height = 40
-        ui_surface = pygame.Surface((panel_width, panel_height), pygame.SRCALPHA)
-        ui_surface.fill((0, 0, 0, 128))
+        panel_height = TOP_PANEL_HEIGHT
+        ui_surface = panel_surface((panel_width, panel_height))
         icon_size = 30
         margin = 10
         x = 70
         y = (panel_height - icon_size) // 2
-        icon1 = pygame.transform.scale(load_image(resource_path("data/png1.png")), (icon_size, icon_size))
-        ui_surface.blit(icon1, (x, y))
-        supply_text = self.font.render(str(self.resources["supply"]), True, WHITE)
-        ui_surface.blit(supply_text, (x + icon_size + margin, (panel_height - supply_text.get_height()) // 2))
-        x += icon_size + margin + supply_text.get_width() + 2 * margin
-        icon2 = pygame.transform.scale(load_image(resource_path("data/png2.png")), (icon_size, icon_size))
-        ui_surface.blit(icon2, (x, y))
-        amm_text = self.font.render(str(self.resources["ammunition"]), True, WHITE)
-        ui_surface.blit(amm_text, (x + icon_size + margin, (panel_height - amm_text.get_height()) // 2))
-        x += icon_size + margin + amm_text.get_width() + 2 * margin
-        icon3 = pygame.transform.scale(load_image(resource_path("data/png3.png")), (icon_size, icon_size))
-        ui_surface.blit(icon3, (x, y))
-        prodpoint_text = self.font.render(str(self.resources["prodpoint"]), True, WHITE)
-        ui_surface.blit(prodpoint_text, (x + icon_size + margin, (panel_height - prodpoint_text.get_height()) // 2))
-        self.screen.blit(ui_surface, (panel_x, panel_y))
+        text_y = (panel_height - self.font.get_height()) // 2
+        counters = [("data/png1.png", "supply"), ("data/png2.png", "ammunition"), ("data/png3.png", "prodpoint")]
+        for icon_path, resource in counters:
+            icon = load_image(resource_path(icon_path), size=(icon_size, icon_size))
+            ui_surface.blit(icon, (x, y))
+            text_width = TEXTS.blit_number(ui_surface, self.font, self.resources[resource], WHITE,
+                                           (x + icon_size + margin, text_y))
+            x += icon_size + margin + text_width + 2 * margin
+        return ui_surface
 
     def draw_speed_buttons(self):
-        button_width = 40
-        button_height = 40
-        spacing = 10
-        start_x = SCREEN_WIDTH - (3 * button_width + 2 * spacing)
-        start_y = 10
-        buttons = []
-        labels = ["<<", "| |", ">>"]
-        for i, label in enumerate(labels):
-            rect = (start_x + i * (button_width + spacing), start_y, button_width, button_height)
-            if label == "| |":
-                color = RED if self.game_paused else GRAY
-            elif label == ">>":
-                color = RED if self.active_speed_button == ">>" else GRAY
-            elif label == "<<":
-                color = RED if self.active_speed_button == "<<" else GRAY
+        for button in self.speed_buttons:
+            if button.text == "| |":
+                active = self.game_paused
             else:
-                color = GRAY
-            button = Button(rect, label, self.font, bg_color=color)
-            buttons.append((button, label))
+                active = self.active_speed_button == button.text
+            button.bg_color = RED if active else GRAY
             button.draw(self.screen)
-        return buttons
-
-    def handle_speed_buttons(self, event, buttons):
-        if event.type == pygame.MOUSEBUTTONDOWN:
-            for button, label in buttons:
-                if button.is_clicked(event):
-                    if label == "| |":
-                        self.toggle_pause()
-                    elif label == ">>":
-                        if self.active_speed_button == ">>":
-                            self.active_speed_button = None
-                            self.game_speed_multiplier = 1.0
-                            if SOUNDS["pause"]:
-                                SOUNDS["pause"].play()
-                        else:
-                            self.active_speed_button = ">>"
-                            self.game_speed_multiplier = 5.0
-                    elif label == "<<":
-                        if self.active_speed_button == "<<":
-                            self.active_speed_button = None
-                            self.game_speed_multiplier = 1.0
-                            if SOUNDS["pause"]:
-                                SOUNDS["pause"].play()
-                        else:
-                            self.active_speed_button = "<<"
-                            self.game_speed_multiplier = 0.2
+
+    def press_speed_button(self, label):
+        if self.lockstep:
+            return
+        if label == "| |":
+            self.toggle_pause()
+        elif self.active_speed_button == label:
+            self.active_speed_button = None
+            self.game_speed_multiplier = 1.0
+            AUDIO.play("pause")
+        else:
+            self.active_speed_button = label
+            self.game_speed_multiplier = 5.0 if label == ">>" else 0.2
 
     def toggle_pause(self):
+        if self.lockstep:
+            return
         self.game_paused = not self.game_paused
-        if SOUNDS["pause"]:
-            SOUNDS["pause"].play()
+        AUDIO.play("pause")
 
-    def handle_events(self):
-        for event in pygame.event.get():
-            self.handle_menu_button(event)
+    def save(self):
+        if not self.autosaver:
+            return
+        self.autosaver.save(self.engine.snapshot())
+        self.last_autosave = time.time()
+
+    def load(self, path=None):
+        try:
+            with open(path or save_path(), "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return False
+        try:
+            self.engine.restore(data)
+        except (ValueError, struct.error) as error:
+            print(f"Could not load save: {error}")
+            return False
+        self.last_update_time = time.time()
+        return True
+
+    def control_state(self):
+        return [self.game_speed_multiplier, self.game_paused, self.settings_active]
+
+    def apply_control(self, control):
+        self.game_speed_multiplier, self.game_paused, self.settings_active = control
+
+    def handle_events(self, events=None):
+        for event in pygame.event.get() if events is None else events:
             if event.type == pygame.QUIT:
                 pygame.quit()
                 sys.exit()
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_ESCAPE:
-                    if SOUNDS["pause"]:
-                        SOUNDS["pause"].play()
+                    AUDIO.play("pause")
                     self.settings_active = not self.settings_active
                     self.game_paused = self.settings_active
+                    if self.settings_active and self.manager:
+                        self.manager.push("settings")
                 if event.key == pygame.K_r and self.popup_active:
                     self.restart()
                 if event.key == pygame.K_s:
                     self.menu.toggle()
                 if event.key == pygame.K_p or event.key == pygame.K_SPACE:
                     self.toggle_pause()
+                if event.key == PROFILER_KEY:
+                    self.profiler.visible = not self.profiler.visible
+                    self.full_redraw = True
+                if event.key == MEMORY_KEY:
+                    self.full_redraw = True
+                if event.key == QUICKSAVE_KEY:
+                    self.save()
+                if event.key == QUICKLOAD_KEY and not self.lockstep:
+                    self.load()
+                if event.key == PROFILER_DUMP_KEY:
+                    print(self.profiler.dump(f"sand_profile_{int(time.time())}.csv"))
+                if event.key in CAMERA_KEYS:
+                    d_col, d_row = CAMERA_KEYS[event.key]
+                    self.camera.pan(d_col * self.camera.tile_size, d_row * self.camera.tile_size)
+            elif event.type == pygame.MOUSEWHEEL and event.y:
+                self.camera.zoom_by(1 if event.y > 0 else -1, self.mouse_pos)
+            if hasattr(event, "pos"):
+                self.mouse_pos = event.pos
             if self.sound_popup:
                 self.sound_popup.handle_event(event)
             elif event.type == pygame.MOUSEBUTTONDOWN:
-                if self.popup_active:
-                    if self.restart_button:
-                        if self.restart_button.is_clicked(event, offset=(SCREEN_WIDTH // 4, SCREEN_HEIGHT // 4)):
-                            self.restart()
-                elif self.menu.open:
-                    truck_rect, bunker_rect = self.menu.draw(self.screen, self.resources, self.font)
-                    if truck_rect.collidepoint(event.pos):
-                        new_upgrade = TruckUpgrade(truck_rect.x, truck_rect.y)
-                        self.all_sprites.add(new_upgrade)
-                        self.upgrade_group.add(new_upgrade)
-                        self.dragging_card = new_upgrade
-                        self.dragging_card_original_pos = (new_upgrade.rect.x, new_upgrade.rect.y)
-                        self.drag_offset_x = event.pos[0] - new_upgrade.rect.x
-                        self.drag_offset_y = event.pos[1] - new_upgrade.rect.y
-                        self.menu.toggle()
-                        continue
-                    elif bunker_rect.collidepoint(event.pos):
-                        new_upgrade = BunkerUpgrade(bunker_rect.x, bunker_rect.y)
-                        self.all_sprites.add(new_upgrade)
-                        self.upgrade_group.add(new_upgrade)
-                        self.dragging_card = new_upgrade
-                        self.dragging_card_original_pos = (new_upgrade.rect.x, new_upgrade.rect.y)
-                        self.drag_offset_x = event.pos[0] - new_upgrade.rect.x
-                        self.drag_offset_y = event.pos[1] - new_upgrade.rect.y
-                        self.menu.toggle()
-                        continue
-                    menu_rect = pygame.Rect(self.menu.x, 0, self.menu.width, self.menu.height)
-                    if not menu_rect.collidepoint(event.pos) and not self.menu_button.collidepoint(event.pos):
-                        self.menu.toggle()
-                else:
-                    self.handle_card_placement(event.pos)
-                speed_buttons = self.draw_speed_buttons()
-                self.handle_speed_buttons(event, speed_buttons)
+                self.ui.dispatch(event)
             elif event.type == pygame.MOUSEMOTION:
                 if self.dragging_card:
                     self.handle_card_drag(event.pos)
-            elif event.type == pygame.MOUSEBUTTONUP:
+            elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
                 self.handle_card_drop()
 
-    def update(self):
+    def update(self, dt=None):
+        pump_assets()
         self.menu.update()
-        tick_speed = 1.0 / self.game_speed_multiplier
-        current_time = time.time()
-        if not self.game_paused:
-            if current_time - self.enemy_spawn_time > tick_speed:
-                self.spawn_enemy()
-                self.enemy_spawn_time = current_time
-            if current_time - self.enemy_move_time > tick_speed:
-                self.move_enemies()
-                self.enemy_move_time = current_time
-        self.update_resources()
+        self.sync_ui()
+        if dt is None:
+            current_time = time.time()
+            dt = current_time - self.last_update_time
+            self.last_update_time = current_time
+        self.frame_dt = dt
+        if self.lockstep:
+            self.lockstep.advance(dt)
+        else:
+            self.engine.step(dt)
         self.all_sprites.update()
+        if not self.popup_active and time.time() - self.last_autosave >= AUTOSAVE_PERIOD:
+            self.save()
 
     def draw(self):
-        if self.settings_active:
-            settings_screen(self.screen, on_back_callback=lambda: setattr(self, 'settings_active', False))
-            return
+        if self.manager and self.manager.memory_visible:
+            self.manager.memory_frames += 1
+        if self.render_mode == "dirty":
+            self.collect_dirty()
+            if not self.full_redraw and not self.dirty_rects:
+                return
+            if not self.full_redraw:
+                self.dirty_rects = merge_dirty_rects(self.cover_outlines(rect) for rect in self.dirty_rects)
+                for region in list(self.dirty_rects):
+                    self.screen.set_clip(region)
+                    self.draw_scene()
+                self.present()
+                return
+        self.draw_scene()
+        self.present()
+
+    def cover_outlines(self, rect):
+        rect = pygame.Rect(rect)
+        for outlined in self.outlined_rects:
+            if rect.colliderect(outlined):
+                rect.union_ip(outlined)
+        return rect
+
+    def draw_scene(self):
         self.screen.fill(BLACK)
-        self.grid.draw(self.screen)
-        self.all_sprites.draw(self.screen)
-        for sprite in self.all_sprites:
-            if hasattr(sprite, 'draw_hp_bar'):
-                sprite.draw_hp_bar(self.screen)
+        self.grid.draw(self.screen, self.camera)
+        self.draw_sprites()
         self.menu.draw(self.screen, self.resources, self.font)
         self.draw_top_ui()
         self.draw_menu_button()
         self.draw_speed_buttons()
         if self.popup_active:
             self.draw_popup()
-        pygame.display.flip()
+        if self.profiler.visible:
+            self.draw_profiler()
+        if self.manager and self.manager.memory_visible:
+            self.screen.blit(*self.manager.memory_overlay())
+
+    def draw_profiler(self):
+        self.screen.blit(*self.profiler_overlay())
+
+    def profiler_overlay(self):
+        key = self.profiler.frames // PROFILER_REFRESH_FRAMES
+        overlay = self.layers.get("profiler", key, self.bake_profiler)
+        return overlay, overlay.get_rect(topright=(SCREEN_WIDTH - 10, TOP_PANEL_HEIGHT + 20))
+
+    def bake_profiler(self):
+        lines = ["phase       p50     p95     p99  (ms)"]
+        for name, (p50, p95, p99) in self.profiler.percentiles().items():
+            lines.append(f"{name:8} {p50 * 1000:7.2f} {p95 * 1000:7.2f} {p99 * 1000:7.2f}")
+        lines.append(f"all {len(self.all_sprites)}  enemy {len(self.enemy_group)}  player {len(self.player_group)}  "
+                     f"placed {len(self.placed_upgrades)}  upgrade {len(self.upgrade_group)}")
+        lines.append(f"images decoded {ASSETS.misses}  cached {len(ASSETS.entries)}  "
+                     f"{ASSETS.used // 1024} KiB  sounds {SOUNDS.loads} ({AUDIO.dropped} dropped)  texts {TEXTS.misses}")
+        lines.append(f"sprites created {SPRITE_POOL.created}  reused {SPRITE_POOL.reused}  "
+                     f"pooled {SPRITE_POOL.stats()['free']}")
+        line_height = self.profiler_font.get_linesize()
+        width, graph_height = 360, 80
+        overlay = panel_surface((width, graph_height + 28 + len(lines) * line_height), 180)
+        pygame.draw.rect(overlay, WHITE, overlay.get_rect(), 1)
+        budget = 1.0 / FPS
+        frame_times = [sample[1] for sample in list(self.profiler.samples)[-PROFILER_GRAPH_FRAMES:]]
+        bar_width = width / PROFILER_GRAPH_FRAMES
+        for i, frame_time in enumerate(frame_times):
+            bar_height = min(graph_height, int(frame_time / (2 * budget) * graph_height))
+            color = GREEN if frame_time <= budget else RED
+            pygame.draw.rect(overlay, color, (int(i * bar_width), 10 + graph_height - bar_height,
+                                              max(1, int(bar_width)), bar_height))
+        pygame.draw.line(overlay, WHITE, (0, 10 + graph_height // 2), (width, 10 + graph_height // 2))
+        y = graph_height + 20
+        for line in lines:
+            overlay.blit(TEXTS.render(self.profiler_font, line, WHITE), (8, y))
+            y += line_height
+        return overlay
+
+    def present(self):
+        self.profiler.mark("draw")
+        if self.manager and self.manager.canvas:
+            self.manager.canvas.present()
+        elif self.render_mode == "dirty" and not self.full_redraw:
+            self.screen.set_clip(None)
+            pygame.display.update(self.dirty_rects)
+        else:
+            pygame.display.flip()
+        self.dirty_rects.clear()
+        self.full_redraw = False
+        self.profiler.mark("flip")
+
+    def enter(self):
+        self.settings_active = False
+        self.last_update_time = time.time()
+        self.full_redraw = True
+        if self.manager:
+            self.screen = self.manager.screen
+        self.layers.invalidate()
+        self.menu.layers.invalidate()
+
+    def exit(self):
+        self.profiler.frame = None
+
+    def close(self):
+        if self.autosaver:
+            self.autosaver.flush()
+        if self.lockstep:
+            self.lockstep.close()
+            self.lockstep = None
+        if self.recorder:
+            self.recorder.close(self.engine)
+            self.recorder = None
+
+    def frame(self, events):
+        self.profiler.begin_frame()
+        control = self.control_state()
+        self.handle_events(events)
+        self.profiler.mark("events")
+        self.frame_dt = 0.0
+        if not self.settings_active:
+            self.update()
+        self.profiler.mark("update")
+        self.draw()
+        self.profiler.mark("draw")
+        if self.recorder:
+            self.recorder.frame(events, self.frame_dt, control)
 
     def run(self):
-        while True:
-            self.handle_events()
-            if not self.settings_active:
-                self.update()
-            self.draw()
-            self.clock.tick(FPS)
-
-
-def main():
-    starting_screen()
-    settings = load_settings()
-    current_volume = settings["volume"]
-    for sound in SOUNDS.values():
-        if sound:
-            sound.set_volume(current_volume / 100)
-    game = Game()
-    game.run()
+        try:
+            while True:
+                self.frame(pygame.event.get())
+                self.clock.tick(FPS)
+        finally:
+            self.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sand Line")
+    parser.add_argument("--record", help="write a replay of this session to the given file")
+    parser.add_argument("--renderer", choices=RENDERERS, help="override the renderer from settings.json")
+    parser.add_argument("--render", choices=RENDER_MODES, help="override the redraw mode from settings.json")
+    parser.add_argument("--host", type=int, nargs="?", const=sand_net.DEFAULT_PORT, metavar="PORT",
+                        help="host a LAN versus game")
+    parser.add_argument("--join", metavar="HOST[:PORT]", help="join a LAN versus game")
+    parser.add_argument("--side", choices=sand_net.SIDES, default=PLAYER, help="side played by the host")
+    parser.add_argument("--transport", choices=sand_net.TRANSPORTS, default="tcp")
+    parser.add_argument("--delay", type=int, default=sand_net.INPUT_DELAY, help="input delay in lockstep turns")
+    args = parser.parse_args(argv)
+
+    session = None
+    if args.host is not None:
+        print(f"Waiting for an opponent on port {args.host}...")
+        session = sand_net.host(args.host, args.side, args.transport, args.delay)
+    elif args.join:
+        address, _, port = args.join.partition(":")
+        session = sand_net.join(address, int(port or sand_net.DEFAULT_PORT))
+
+    pygame.init()
+    AUDIO.set_volume(SETTINGS.load()["volume"])
+    if args.renderer:
+        SETTINGS.override("renderer", args.renderer)
+    if args.render:
+        SETTINGS.override("render_mode", args.render)
+    manager = SceneManager()
+    manager.register("loading", LoadingScene)
+    manager.register("menu", MenuScene)
+    manager.register("settings", SettingsScene)
+    manager.register("tutorial", TutorialScene)
+    if session:
+        manager.register("game", lambda manager: Game(manager=manager, autosave=False, net=session))
+    else:
+        manager.register("game", lambda manager: Game(record=args.record, manager=manager))
+    manager.run("loading")
 
 
 if __name__ == "__main__":
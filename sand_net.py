@@ -0,0 +1,536 @@
+import sys
+import time
+import random
+import select
+import socket
+import struct
+import argparse
+import threading
+
+from sand_engine import (Engine, PlaceCard, MoveCard, PlaceUpgrade, DirectSpawn, PLAYER, ENEMY, UPGRADE_KINDS,
+                         BOARD_ROWS, BOARD_COLUMNS, PLAYER_COLUMNS, TICK_RATE, MAX_CATCHUP_TICKS)
+
+NET_MAGIC = b"SNDL"
+NET_VERSION = 1
+DEFAULT_PORT = 4777
+TURN_TICKS = 4
+INPUT_DELAY = 2
+CHECKSUM_TURNS = 5
+ACK_DELAY = 0.25
+RESEND_DELAY = 0.4
+HANDSHAKE_TIMEOUT = 60.0
+TRANSPORTS = ("tcp", "udp")
+SIDES = (PLAYER, ENEMY)
+HELLO = struct.Struct("<4sHIHHHHHB?H")
+FRAME = struct.Struct("<H")
+DATAGRAM = struct.Struct("<II")
+UDP_PORT = struct.Struct("<H")
+CRC = struct.Struct("<I")
+MSG_TURN = 1
+MSG_BYE = 2
+COMMANDS = [
+    (PlaceCard, ("row", "col")),
+    (MoveCard, ("from_row", "from_col", "row", "col")),
+    (PlaceUpgrade, ("kind", "row", "col")),
+    (DirectSpawn, ("row",)),
+]
+SIDE_COMMANDS = {PLAYER: (PlaceCard, MoveCard, PlaceUpgrade), ENEMY: (DirectSpawn,)}
+
+
+def write_varint(out, value):
+    while value >= 0x80:
+        out.append(value & 0x7F | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def read_varint(data, offset):
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def encode_command(out, command):
+    code = next(i for i, (kind, fields) in enumerate(COMMANDS) if isinstance(command, kind))
+    out.append(code)
+    for field in COMMANDS[code][1]:
+        value = getattr(command, field)
+        write_varint(out, UPGRADE_KINDS.index(value) if field == "kind" else value)
+
+
+def decode_command(data, offset):
+    kind, fields = COMMANDS[data[offset]]
+    offset += 1
+    values = []
+    for field in fields:
+        value, offset = read_varint(data, offset)
+        values.append(UPGRADE_KINDS[value] if field == "kind" else value)
+    return kind(*values), offset
+
+
+def encode_checksum(out, turn, total, lanes, previous):
+    write_varint(out, turn)
+    out += CRC.pack(total)
+    mask = 0
+    for lane, (crc, old) in enumerate(zip(lanes, previous)):
+        if crc != old:
+            mask |= 1 << lane
+    write_varint(out, mask)
+    for lane, (crc, old) in enumerate(zip(lanes, previous)):
+        if crc != old:
+            out += CRC.pack(crc)
+
+
+def decode_checksum(data, offset, previous):
+    turn, offset = read_varint(data, offset)
+    total, = CRC.unpack_from(data, offset)
+    mask, offset = read_varint(data, offset + CRC.size)
+    lanes = list(previous)
+    for lane in range(len(lanes)):
+        if mask >> lane & 1:
+            lanes[lane], = CRC.unpack_from(data, offset)
+            offset += CRC.size
+    return turn, total, lanes, offset
+
+
+def encode_turn(turn, commands, checksum=None):
+    out = bytearray([MSG_TURN])
+    write_varint(out, turn)
+    write_varint(out, len(commands))
+    for command in commands:
+        encode_command(out, command)
+    out.append(checksum is not None)
+    if checksum is not None:
+        encode_checksum(out, *checksum)
+    return bytes(out)
+
+
+def decode_turn(data, previous):
+    turn, offset = read_varint(data, 1)
+    count, offset = read_varint(data, offset)
+    commands = []
+    for _ in range(count):
+        command, offset = decode_command(data, offset)
+        commands.append(command)
+    checksum = None
+    if data[offset]:
+        checksum = decode_checksum(data, offset + 1, previous)[:3]
+    return turn, commands, checksum
+
+
+def send_frame(sock, payload):
+    sock.sendall(FRAME.pack(len(payload)) + payload)
+
+
+def recv_exact(sock, size):
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("peer closed the connection")
+        data += chunk
+    return data
+
+
+def recv_frame(sock):
+    size, = FRAME.unpack(recv_exact(sock, FRAME.size))
+    return recv_exact(sock, size)
+
+
+class TcpLink:
+    overhead = 40
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.incoming = bytearray()
+        self.outgoing = bytearray()
+        self.bytes_sent = self.bytes_received = 0
+        self.packets_sent = self.packets_received = 0
+
+    def send(self, payload):
+        self.outgoing += FRAME.pack(len(payload)) + payload
+        self.flush()
+
+    def flush(self):
+        while self.outgoing:
+            try:
+                sent = self.sock.send(self.outgoing)
+            except BlockingIOError:
+                return
+            del self.outgoing[:sent]
+            self.bytes_sent += sent
+            self.packets_sent += 1
+
+    def receive(self):
+        self.flush()
+        while True:
+            try:
+                chunk = self.sock.recv(4096)
+            except BlockingIOError:
+                break
+            if not chunk:
+                raise ConnectionError("peer closed the connection")
+            self.incoming += chunk
+            self.bytes_received += len(chunk)
+            self.packets_received += 1
+        messages = []
+        while len(self.incoming) >= FRAME.size:
+            size, = FRAME.unpack_from(self.incoming)
+            if len(self.incoming) < FRAME.size + size:
+                break
+            messages.append(bytes(self.incoming[FRAME.size:FRAME.size + size]))
+            del self.incoming[:FRAME.size + size]
+        return messages
+
+    def wait(self, timeout):
+        select.select([self.sock], [], [], timeout)
+
+    def close(self):
+        try:
+            self.sock.setblocking(True)
+            self.flush()
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class UdpLink:
+    overhead = 28
+
+    def __init__(self, sock, peer):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.peer = peer
+        self.seq = 0
+        self.unacked = {}
+        self.expected = 1
+        self.buffered = {}
+        self.ack_since = None
+        self.bytes_sent = self.bytes_received = 0
+        self.packets_sent = self.packets_received = 0
+
+    def transmit(self, seq, payload=b""):
+        datagram = DATAGRAM.pack(seq, self.expected - 1) + payload
+        try:
+            self.sock.sendto(datagram, self.peer)
+        except (BlockingIOError, ConnectionRefusedError):
+            return
+        self.bytes_sent += len(datagram)
+        self.packets_sent += 1
+        self.ack_since = None
+
+    def send(self, payload):
+        self.seq += 1
+        self.unacked[self.seq] = [payload, time.perf_counter()]
+        self.transmit(self.seq, payload)
+
+    def receive(self):
+        messages = []
+        while True:
+            try:
+                datagram, address = self.sock.recvfrom(65536)
+            except (BlockingIOError, ConnectionRefusedError):
+                break
+            if address[0] != self.peer[0] or len(datagram) < DATAGRAM.size:
+                continue
+            self.bytes_received += len(datagram)
+            self.packets_received += 1
+            seq, ack = DATAGRAM.unpack_from(datagram)
+            for acked in [key for key in self.unacked if key <= ack]:
+                del self.unacked[acked]
+            if seq == 0:
+                continue
+            if self.ack_since is None:
+                self.ack_since = time.perf_counter()
+            if seq >= self.expected:
+                self.buffered[seq] = datagram[DATAGRAM.size:]
+            while self.expected in self.buffered:
+                messages.append(self.buffered.pop(self.expected))
+                self.expected += 1
+        now = time.perf_counter()
+        for seq, message in self.unacked.items():
+            if now - message[1] >= RESEND_DELAY:
+                message[1] = now
+                self.transmit(seq, message[0])
+        if self.ack_since is not None and now - self.ack_since >= ACK_DELAY:
+            self.transmit(0)
+        return messages
+
+    def wait(self, timeout):
+        select.select([self.sock], [], [], timeout)
+
+    def close(self):
+        self.sock.close()
+
+
+class Session:
+    def __init__(self, link, side, seed, rows, columns, tick_rate, turn_ticks, delay):
+        self.link = link
+        self.side = side
+        self.seed = seed
+        self.rows = rows
+        self.columns = columns
+        self.tick_rate = tick_rate
+        self.turn_ticks = turn_ticks
+        self.delay = delay
+
+
+def host(port=DEFAULT_PORT, side=PLAYER, transport="tcp", delay=INPUT_DELAY, turn_ticks=TURN_TICKS, seed=None,
+         rows=BOARD_ROWS, columns=BOARD_COLUMNS, tick_rate=TICK_RATE, bind="", timeout=HANDSHAKE_TIMEOUT):
+    seed = random.randrange(2 ** 32) if seed is None else seed
+    with socket.create_server((bind, port)) as listener:
+        listener.settimeout(timeout)
+        conn, address = listener.accept()
+    conn.settimeout(timeout)
+    udp = None
+    if transport == "udp":
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind((bind, 0))
+    remote_side = SIDES[1 - SIDES.index(side)]
+    send_frame(conn, HELLO.pack(NET_MAGIC, NET_VERSION, seed, rows, columns, tick_rate, turn_ticks, delay,
+                                SIDES.index(remote_side), udp is not None, udp.getsockname()[1] if udp else 0))
+    if udp:
+        peer_port, = UDP_PORT.unpack(recv_frame(conn))
+        conn.close()
+        link = UdpLink(udp, (address[0], peer_port))
+    else:
+        link = TcpLink(conn)
+    return Session(link, side, seed, rows, columns, tick_rate, turn_ticks, delay)
+
+
+def join(address, port=DEFAULT_PORT, timeout=HANDSHAKE_TIMEOUT):
+    conn = socket.create_connection((address, port), timeout)
+    magic, version, seed, rows, columns, tick_rate, turn_ticks, delay, side, use_udp, udp_port = \
+        HELLO.unpack(recv_frame(conn))
+    if magic != NET_MAGIC or version != NET_VERSION:
+        conn.close()
+        raise ConnectionError(f"unsupported peer protocol {magic!r} v{version}")
+    if use_udp:
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        udp.bind((conn.getsockname()[0], 0))
+        send_frame(conn, UDP_PORT.pack(udp.getsockname()[1]))
+        link = UdpLink(udp, (conn.getpeername()[0], udp_port))
+        conn.close()
+    else:
+        link = TcpLink(conn)
+    return Session(link, SIDES[side], seed, rows, columns, tick_rate, turn_ticks, delay)
+
+
+class Lockstep:
+    def __init__(self, engine, session):
+        self.engine = engine
+        self.engine.spawn_row = engine.rows // 2
+        self.link = session.link
+        self.side = session.side
+        self.other = SIDES[1 - SIDES.index(session.side)]
+        self.turn_ticks = session.turn_ticks
+        self.delay = session.delay
+        self.turn = 0
+        self.tick_in_turn = 0
+        self.accumulator = 0.0
+        self.pending = []
+        self.inputs = {side: {turn: [] for turn in range(self.delay)} for side in SIDES}
+        self.sent_lanes = [0] * engine.rows
+        self.received_lanes = [0] * engine.rows
+        self.local_checksums = {}
+        self.remote_checksums = {}
+        self.checked = 0
+        self.desync = None
+        self.stalls = 0
+        self.stalled = False
+        self.closed = False
+        self.started = time.perf_counter()
+
+    def queue(self, command):
+        if isinstance(command, SIDE_COMMANDS[self.side]):
+            self.pending.append(command)
+
+    def poll(self):
+        try:
+            messages = self.link.receive()
+        except ConnectionError:
+            self.closed = True
+            return
+        for message in messages:
+            if message[0] == MSG_BYE:
+                self.closed = True
+            elif message[0] == MSG_TURN:
+                turn, commands, checksum = decode_turn(message, self.received_lanes)
+                self.inputs[self.other][turn] = commands
+                if checksum:
+                    self.received_lanes = checksum[2]
+                    self.remote_checksums[checksum[0]] = checksum[1:]
+                    self.compare(checksum[0])
+
+    def advance(self, dt):
+        self.poll()
+        tick_dt = self.engine.scheduler.tick_dt
+        self.accumulator = min(self.accumulator + dt, MAX_CATCHUP_TICKS * tick_dt)
+        ticks = 0
+        while self.accumulator >= tick_dt:
+            if self.tick_in_turn == 0 and not self.begin_turn():
+                if not self.stalled:
+                    self.stalls += 1
+                self.stalled = True
+                break
+            self.stalled = False
+            self.engine.scheduler.run_tick()
+            self.accumulator -= tick_dt
+            self.tick_in_turn += 1
+            if self.tick_in_turn == self.turn_ticks:
+                self.tick_in_turn = 0
+                self.turn += 1
+            ticks += 1
+        return ticks
+
+    def begin_turn(self):
+        if self.turn not in self.inputs[self.other]:
+            return False
+        checksum = None
+        if self.turn % CHECKSUM_TURNS == 0:
+            lanes = self.engine.lane_checksums()
+            checksum = (self.turn, self.engine.checksum(), lanes, self.sent_lanes)
+            self.local_checksums[self.turn] = (checksum[1], lanes)
+            self.sent_lanes = lanes
+        commands, self.pending = self.pending, []
+        self.inputs[self.side][self.turn + self.delay] = commands
+        self.link.send(encode_turn(self.turn + self.delay, commands, checksum))
+        if checksum:
+            self.compare(self.turn)
+        for side in SIDES:
+            for command in self.inputs[side].pop(self.turn):
+                if isinstance(command, SIDE_COMMANDS[side]):
+                    self.engine.execute(command)
+        return True
+
+    def compare(self, turn):
+        if turn not in self.local_checksums or turn not in self.remote_checksums:
+            return
+        local_total, local_lanes = self.local_checksums.pop(turn)
+        remote_total, remote_lanes = self.remote_checksums.pop(turn)
+        self.checked += 1
+        if local_total != remote_total and self.desync is None:
+            lanes = [row for row, (a, b) in enumerate(zip(local_lanes, remote_lanes)) if a != b]
+            self.desync = (turn, lanes)
+            print(f"Desync at turn {turn}, lanes {lanes or 'resources'}")
+
+    def stats(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        link = self.link
+        return {
+            "turn": self.turn,
+            "tick": self.engine.scheduler.tick,
+            "stalls": self.stalls,
+            "checked": self.checked,
+            "desync": self.desync,
+            "sent_bps": link.bytes_sent / elapsed,
+            "received_bps": link.bytes_received / elapsed,
+            "wire_bps": (link.bytes_sent + link.packets_sent * link.overhead) / elapsed,
+            "packets_per_second": link.packets_sent / elapsed,
+        }
+
+    def close(self):
+        if not self.closed:
+            try:
+                self.link.send(bytes([MSG_BYE]))
+            except OSError:
+                pass
+        self.link.close()
+
+
+def defender_bot(engine, requested, turn):
+    for row in range(engine.rows):
+        if engine.index.row_enemies[row] and requested.get(row, -1) < turn:
+            if not any(engine.unit_at(row, col) for col in range(PLAYER_COLUMNS)):
+                requested[row] = turn + INPUT_DELAY
+                yield PlaceCard(row, PLAYER_COLUMNS - 1)
+
+
+def attacker_bot(engine, requested, turn):
+    defenders = [0] * engine.rows
+    for unit in engine.players:
+        defenders[unit.row] += 1
+    row = min(range(engine.rows), key=lambda row: (defenders[row], (row - turn) % engine.rows))
+    if row != engine.spawn_row and requested.get("lane", -1) < turn:
+        requested["lane"] = turn + INPUT_DELAY
+        yield DirectSpawn(row)
+
+
+BOTS = {PLAYER: defender_bot, ENEMY: attacker_bot}
+
+
+def play(session, seconds):
+    engine = Engine(session.rows, session.columns, session.seed, session.tick_rate)
+    lockstep = Lockstep(engine, session)
+    bot = BOTS[session.side]
+    requested = {}
+    start = last = time.perf_counter()
+    while not lockstep.closed and last - start < seconds:
+        for command in bot(engine, requested, lockstep.turn):
+            lockstep.queue(command)
+        now = time.perf_counter()
+        lockstep.advance(now - last)
+        last = now
+        lockstep.link.wait(engine.scheduler.tick_dt / 4)
+    lockstep.close()
+    return lockstep
+
+
+def report(name, lockstep):
+    stats = lockstep.stats()
+    print(f"{name:6} turn {stats['turn']:5}  tick {stats['tick']:6}  stalls {stats['stalls']:3}  "
+          f"checksums {stats['checked']:4}  desync {stats['desync']}  "
+          f"payload {stats['sent_bps']:6.1f} B/s  wire {stats['wire_bps']:6.1f} B/s  "
+          f"{stats['packets_per_second']:4.1f} pkt/s")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Sand Line LAN lockstep versus")
+    parser.add_argument("mode", choices=("host", "join", "local"), help="local runs both peers over localhost")
+    parser.add_argument("address", nargs="?", default="127.0.0.1", help="host to join")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--side", choices=SIDES, default=PLAYER, help="side played by the host")
+    parser.add_argument("--transport", choices=TRANSPORTS, default="tcp")
+    parser.add_argument("--delay", type=int, default=INPUT_DELAY, help="input delay in turns")
+    parser.add_argument("--turn-ticks", type=int, default=TURN_TICKS, help="simulation ticks per lockstep turn")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--seconds", type=float, default=30.0, help="how long the headless bots play")
+    args = parser.parse_args(argv)
+
+    if args.mode == "join":
+        stats = report("join", play(join(args.address, args.port), args.seconds))
+        return 1 if stats["desync"] else 0
+    if args.mode == "host":
+        print(f"Waiting for a peer on port {args.port}...")
+        stats = report("host", play(host(args.port, args.side, args.transport, args.delay, args.turn_ticks,
+                                         args.seed), args.seconds))
+        return 1 if stats["desync"] else 0
+    results = {}
+    hosting = threading.Thread(target=lambda: results.update(
+        host=play(host(args.port, args.side, args.transport, args.delay, args.turn_ticks, args.seed,
+                       bind="127.0.0.1"), args.seconds)))
+    hosting.start()
+    for _ in range(50):
+        try:
+            session = join("127.0.0.1", args.port)
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.1)
+    else:
+        raise ConnectionError("local host did not start")
+    results["join"] = play(session, args.seconds)
+    hosting.join()
+    desyncs = [report(name, results[name])["desync"] for name in ("host", "join")]
+    return 1 if any(desyncs) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
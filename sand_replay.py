@@ -0,0 +1,72 @@
+import os
+import sys
+import time
+import argparse
+import statistics
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import sand_game
+
+
+def replay(path, draw=False):
+    header, frames, footer = sand_game.load_replay(path)
+    pygame.init()
+    game = sand_game.Game(seed=header["seed"], board_size=tuple(header["board"]), autosave=False)
+    timings = []
+    start = time.perf_counter()
+    for dt, events, control in frames:
+        frame_start = time.perf_counter()
+        if control is not None:
+            game.apply_control(control)
+        game.handle_events(events)
+        if not game.settings_active:
+            game.update(dt)
+        if draw and not game.settings_active:
+            game.draw()
+        timings.append(time.perf_counter() - frame_start)
+    wall = time.perf_counter() - start
+    return {
+        "frames": len(frames),
+        "simulated": sum(frame[0] for frame in frames),
+        "wall": wall,
+        "timings": timings,
+        "checksum": game.engine.checksum(),
+        "expected": footer.get("checksum"),
+    }
+
+
+def report(result):
+    timings = sorted(result["timings"]) or [0.0]
+
+    def percentile(q):
+        return timings[min(len(timings) - 1, int(len(timings) * q))] * 1000
+
+    print(f"frames     {result['frames']}")
+    print(f"simulated  {result['simulated']:.1f} s")
+    print(f"wall       {result['wall']:.3f} s  (x{result['simulated'] / max(result['wall'], 1e-9):.0f})")
+    print(f"frame ms   mean {statistics.fmean(timings) * 1000:.3f}  p50 {percentile(0.5):.3f}  "
+          f"p95 {percentile(0.95):.3f}  p99 {percentile(0.99):.3f}  max {timings[-1] * 1000:.3f}")
+    status = "no recorded checksum"
+    if result["expected"] is not None:
+        status = "match" if result["checksum"] == result["expected"] else f"MISMATCH (recorded {result['expected']:08x})"
+    print(f"checksum   {result['checksum']:08x}  {status}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded Sand Line session headlessly")
+    parser.add_argument("replay", help="replay file written by sand_game.py --record")
+    parser.add_argument("--draw", action="store_true", help="also render every frame to the hidden display")
+    args = parser.parse_args(argv)
+
+    result = replay(args.replay, args.draw)
+    report(result)
+    if result["expected"] is not None and result["checksum"] != result["expected"]:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())